@@ -1,11 +1,17 @@
+import json
 import os
 import tempfile
+import threading
+import time
 
 import git
 import pytest
 
-from tracksuite.deploy import GitDeployment
+from tracksuite.cache import CloneCache
+from tracksuite.deploy import GitDeployment, main, read_plan
 from tracksuite.init import setup_remote
+from tracksuite.metrics import excluded, record
+from tracksuite.repos import RemoteMovedError
 
 
 @pytest.fixture
@@ -150,3 +156,384 @@ def test_deploy_files(git_deployment):
     assert os.path.exists(os.path.join(deployer.target_dir, "file1.txt"))
     assert os.path.exists(os.path.join(deployer.target_dir, "file2.txt"))
     assert not os.path.exists(os.path.join(deployer.target_dir, "file3.txt"))
+
+
+def test_remote_fetch_cached(git_deployment_with_backup, mocker):
+    deployer = git_deployment_with_backup
+    deployer.pull_remotes()
+
+    execute = mocker.spy(git.cmd.Git, "execute")
+
+    def fetch_count():
+        return sum("fetch" in call.args[1] for call in execute.call_args_list)
+
+    hash_init = deployer.check_sync_local_remote("target")
+    deployer.check_sync_local_remote("backup")
+    deployer.check_sync_remotes("target", "backup")
+    assert fetch_count() == 0
+
+    assert deployer.get_hash_remote("target", refresh=True) == hash_init
+    assert deployer.fetch_remotes(force=True) == {
+        "target": hash_init,
+        "backup": hash_init,
+    }
+    assert fetch_count() == 2
+
+
+def test_pull_remotes_concurrent_fetch(git_deployment_with_backup, mocker):
+    deployer = git_deployment_with_backup
+    execute = mocker.spy(git.cmd.Git, "execute")
+    threads = {}
+    original = deployer.fetch
+
+    def fetch(remote, force=False):
+        threads.setdefault(remote, threading.current_thread().name)
+        return original(remote, force)
+
+    mocker.patch.object(deployer, "fetch", side_effect=fetch)
+    deployer.pull_remotes()
+
+    # target and backup are fetched at the same time, once each
+    assert set(threads) == {"target", "backup"}
+    assert threading.main_thread().name not in threads.values()
+    fetches = [call for call in execute.call_args_list if "fetch" in call.args[1]]
+    assert len(fetches) == 2
+
+
+def test_push_remote_moved(git_deployment):
+    deployer = git_deployment
+    deployer.pull_remotes()
+    hash_init = deployer.check_sync_local_remote("target")
+
+    # someone else deploys to the target in the meantime
+    git.Repo(deployer.target_dir).index.commit("concurrent change")
+
+    deployer.repo.index.commit("my change")
+    with pytest.raises(RemoteMovedError):
+        deployer.push("target", expected=hash_init)
+
+
+def test_push_to_remotes_target_moved(git_deployment_with_backup):
+    deployer = git_deployment_with_backup
+    deployer.pull_remotes()
+    hash_init = deployer.check_sync_local_remote("target")
+
+    git.Repo(deployer.target_dir).index.commit("concurrent change")
+
+    deployer.repo.index.commit("my change")
+    with pytest.raises(RemoteMovedError):
+        deployer.push_to_remotes(expected=hash_init)
+    # the backup is not pushed when the target rejected the change
+    assert git.Repo(deployer.backup_repo).head.commit.hexsha == hash_init
+
+
+def test_cached_clone(git_deployment, tmp_path, monkeypatch):
+    monkeypatch.setenv("TRACKSUITE_CACHE_DIR", str(tmp_path))
+    deployer = git_deployment
+    options = dict(
+        host="localhost",
+        user=deployer.user,
+        staging_dir=deployer.staging_dir,
+        target_repo=deployer.target_dir,
+        use_cache=True,
+    )
+
+    first = GitDeployment(**options)
+    assert first.local_dir.startswith(str(tmp_path))
+
+    # the cached clone is locked, a temporary clone is used instead
+    second = GitDeployment(**options)
+    assert second.local_dir != first.local_dir
+
+    # leftovers of a failed deployment are discarded when the clone is reused
+    first.repo.index.commit("unpushed change")
+    first.close()
+    third = GitDeployment(**options)
+    assert third.local_dir == first.local_dir
+    third.check_sync_local_remote("target")
+
+
+def test_deploy_direct(git_deployment):
+    deployer = git_deployment
+    direct_deployer = GitDeployment(
+        host="localhost",
+        user=deployer.user,
+        staging_dir=deployer.staging_dir,
+        target_repo=deployer.target_dir,
+        direct=True,
+    )
+    staging_dir = direct_deployer.staging_dir
+
+    os.mkdir(staging_dir)
+    with open(os.path.join(staging_dir, "dummy.txt"), "w") as f:
+        f.write("dummy content")
+    os.mkdir(os.path.join(staging_dir, "family"))
+    with open(os.path.join(staging_dir, "family", "task.ecf"), "w") as f:
+        f.write("task content")
+
+    direct_deployer.pull_remotes()
+    diff = direct_deployer.diff_staging()
+    assert diff.added == ["family/task.ecf"]
+    assert diff.modified == ["dummy.txt"]
+    assert diff.removed == []
+    direct_deployer.deploy("This is my change")
+
+    with open(os.path.join(deployer.target_dir, "dummy.txt"), "r") as f:
+        assert f.read() == "dummy content"
+    with open(os.path.join(deployer.target_dir, "family", "task.ecf"), "r") as f:
+        assert f.read() == "task content"
+
+    # the suite is never copied to the local repository
+    assert not os.path.exists(os.path.join(direct_deployer.local_dir, "family"))
+
+    # same commit content as a regular deployment
+    deployer.pull_remotes()
+    assert not deployer.deploy()
+
+    # pulling the changes of others only updates the index of the direct deployer
+    with open(os.path.join(staging_dir, "upstream.txt"), "w") as f:
+        f.write("upstream content")
+    assert deployer.deploy("upstream change")
+    direct_deployer.pull_remotes()
+    assert direct_deployer.repo.head.commit == deployer.repo.head.commit
+    assert not os.path.exists(os.path.join(direct_deployer.local_dir, "upstream.txt"))
+    assert not direct_deployer.diff_staging().new_paths()
+
+
+def test_deploy_only_copies_changes(git_deployment):
+    deployer = git_deployment
+    staging_dir = deployer.staging_dir
+
+    os.mkdir(staging_dir)
+    for file in ["file1.txt", "file2.txt"]:
+        with open(os.path.join(staging_dir, file), "w") as f:
+            f.write(f"content of {file}")
+    deployer.pull_remotes()
+    deployer.deploy()
+
+    with open(os.path.join(staging_dir, "file2.txt"), "w") as f:
+        f.write("new content")
+    os.remove(os.path.join(staging_dir, "file1.txt"))
+    os.mkdir(os.path.join(staging_dir, "family"))
+    with open(os.path.join(staging_dir, "family", "task.ecf"), "w") as f:
+        f.write("task")
+
+    diff = deployer.sync_staging()
+    assert diff.added == ["family/task.ecf"]
+    assert diff.modified == ["file2.txt"]
+    assert diff.removed == ["file1.txt"]
+    assert diff.added_bytes == 4
+    assert diff.modified_bytes == 11
+
+    # nothing left to copy, the manifest hashes match the index
+    deployer.commit()
+    assert not deployer.sync_staging()
+
+
+def test_diff_staging_renamed(git_deployment):
+    deployer = git_deployment
+    staging_dir = deployer.staging_dir
+
+    os.makedirs(os.path.join(staging_dir, "family"))
+    with open(os.path.join(staging_dir, "family", "task.ecf"), "w") as f:
+        f.write("task")
+    deployer.pull_remotes()
+    deployer.deploy()
+
+    os.rename(
+        os.path.join(staging_dir, "family"), os.path.join(staging_dir, "new_family")
+    )
+    diff = deployer.diff_staging()
+    assert diff.renamed == [("family/task.ecf", "new_family/task.ecf")]
+    assert not diff.added and not diff.removed and not diff.modified
+
+    deployer.deploy()
+    assert os.path.exists(os.path.join(deployer.target_dir, "new_family", "task.ecf"))
+    assert not os.path.exists(os.path.join(deployer.target_dir, "family"))
+
+
+def test_deploy_plan_apply(git_deployment, tmp_path):
+    deployer = git_deployment
+    staging_dir = deployer.staging_dir
+
+    os.mkdir(staging_dir)
+    with open(os.path.join(staging_dir, "dummy.txt"), "w") as f:
+        f.write("dummy content")
+    deployer.pull_remotes()
+
+    plan_file = str(tmp_path / "plan.json")
+    plan = deployer.write_plan(plan_file, "This is my change")
+    assert plan["diff"]["modified"] == ["dummy.txt"]
+    assert read_plan(plan_file)["target"] == deployer.target_dir
+
+    assert deployer.apply_plan(plan)
+    with open(os.path.join(deployer.target_dir, "dummy.txt"), "r") as f:
+        assert f.read() == "dummy content"
+    assert "This is my change" in deployer.repo.head.commit.message
+
+    # the plan can only be applied on the state it was computed for
+    with pytest.raises(RemoteMovedError):
+        deployer.apply_plan(plan)
+
+
+def test_deploy_main_apply(git_deployment, tmp_path, monkeypatch):
+    deployer = git_deployment
+    staging_dir = deployer.staging_dir
+
+    os.mkdir(staging_dir)
+    with open(os.path.join(staging_dir, "dummy.txt"), "w") as f:
+        f.write("dummy content")
+    deployer.pull_remotes()
+    plan_file = str(tmp_path / "plan.json")
+    deployer.write_plan(plan_file)
+
+    # the target, host and user come from the plan
+    monkeypatch.setattr(
+        "sys.argv", ["tracksuite-deploy", "--apply", plan_file, "--no-cache"]
+    )
+    monkeypatch.setattr("builtins.input", lambda prompt: "y")
+    main()
+    with open(os.path.join(deployer.target_dir, "dummy.txt"), "r") as f:
+        assert f.read() == "dummy content"
+
+
+def test_deploy_plan_staging_changed(git_deployment, tmp_path):
+    deployer = git_deployment
+    staging_dir = deployer.staging_dir
+
+    os.mkdir(staging_dir)
+    with open(os.path.join(staging_dir, "dummy.txt"), "w") as f:
+        f.write("dummy content")
+    deployer.pull_remotes()
+
+    plan_file = str(tmp_path / "plan.json")
+    plan = deployer.write_plan(plan_file)
+
+    with open(os.path.join(staging_dir, "dummy.txt"), "w") as f:
+        f.write("other content")
+    with pytest.raises(Exception, match="Staged suite has changed"):
+        deployer.apply_plan(plan)
+
+
+def test_diff_staging_ignored(git_deployment):
+    deployer = git_deployment
+    staging_dir = deployer.staging_dir
+
+    os.mkdir(staging_dir)
+    with open(os.path.join(staging_dir, ".gitignore"), "w") as f:
+        f.write("*.log\n")
+    with open(os.path.join(staging_dir, "task.log"), "w") as f:
+        f.write("log")
+    deployer.pull_remotes()
+
+    diff = deployer.diff_staging()
+    assert diff.added == [".gitignore"]
+    deployer.deploy()
+    assert not os.path.exists(os.path.join(deployer.target_dir, "task.log"))
+
+
+def test_deploy_files_glob(git_deployment):
+    deployer = git_deployment
+    staging_dir = deployer.staging_dir
+
+    for path in ["family/a.ecf", "family/b.ecf", "family/sub/d.ecf", "other/c.ecf"]:
+        os.makedirs(os.path.join(staging_dir, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(staging_dir, path), "w") as f:
+            f.write("old")
+    deployer.pull_remotes()
+    deployer.deploy()
+
+    for path in ["family/a.ecf", "family/sub/d.ecf", "other/c.ecf"]:
+        with open(os.path.join(staging_dir, path), "w") as f:
+            f.write("new")
+    os.remove(os.path.join(staging_dir, "family", "b.ecf"))
+
+    diff = deployer.diff_staging(["family/*.ecf"])
+    assert diff.modified == ["family/a.ecf"]
+    assert diff.removed == ["family/b.ecf"]
+    assert not diff.added
+
+    deployer.deploy(files=["family/*.ecf"])
+
+    def read_target(path):
+        with open(os.path.join(deployer.target_dir, path), "r") as f:
+            return f.read()
+
+    assert read_target("family/a.ecf") == "new"
+    assert not os.path.exists(os.path.join(deployer.target_dir, "family", "b.ecf"))
+    assert read_target("family/sub/d.ecf") == "old"
+    assert read_target("other/c.ecf") == "old"
+
+    deployer.deploy(files=["family/**"])
+    assert read_target("family/sub/d.ecf") == "new"
+    assert read_target("other/c.ecf") == "old"
+
+
+def test_deploy_metrics(git_deployment, tmp_path):
+    deployer = git_deployment
+    os.mkdir(deployer.staging_dir)
+    with open(os.path.join(deployer.staging_dir, "dummy2.txt"), "w") as f:
+        f.write("dummy content")
+
+    with record("deploy", str(tmp_path / "metrics.prom")) as metrics:
+        deployer.pull_remotes()
+        deployer.deploy("metrics")
+
+    phases = metrics.phases()
+    for phase in ["fetch", "pull", "diff", "stage", "commit", "push"]:
+        assert phase in phases
+    assert phases["stage"]["bytes"] == len("dummy content")
+    assert phases["fetch"]["bytes"] == 0
+    assert phases["push"]["bytes"] > 0
+    assert metrics.duration > 0
+
+    content = (tmp_path / "metrics.prom").read_text()
+    assert 'tracksuite_phase_bytes{operation="deploy",phase="stage"} 13' in content
+    assert 'tracksuite_operation_duration_seconds{operation="deploy"}' in content
+
+    metrics.write(str(tmp_path / "metrics.json"))
+    with open(tmp_path / "metrics.json") as f:
+        content = json.load(f)
+    assert content["operation"] == "deploy"
+    assert {span["name"] for span in content["spans"]} == set(phases)
+
+
+def test_deploy_without_metrics(git_deployment, mocker):
+    # the transferred bytes are only measured while an operation is recorded
+    deployer = git_deployment
+    os.mkdir(deployer.staging_dir)
+    with open(os.path.join(deployer.staging_dir, "dummy2.txt"), "w") as f:
+        f.write("dummy content")
+    objects_size = mocker.patch.object(deployer, "_objects_size")
+    storage_size = mocker.patch.object(deployer, "_storage_size")
+
+    deployer.pull_remotes()
+    deployer.deploy("no metrics")
+    objects_size.assert_not_called()
+    storage_size.assert_not_called()
+
+
+def test_metrics_excluded():
+    with record("confirm") as metrics:
+        with excluded():
+            time.sleep(0.5)
+    assert metrics.duration < 0.4
+
+
+def test_cache_eviction_removes_lock(tmp_path):
+    cache = CloneCache(str(tmp_path), max_age=0)
+    path, lock = cache.acquire("user", "host", "/path/to/target")
+    os.makedirs(path)
+    cache.release(lock)
+    time.sleep(0.01)
+
+    # an entry in use is never evicted
+    path_in_use, lock_in_use = cache.acquire("user", "host", "/path/to/other")
+    os.makedirs(path_in_use)
+    os.remove(os.path.join(str(tmp_path), ".last_eviction"))
+    cache.evict()
+    assert not os.path.exists(path)
+    assert not os.path.exists(f"{path}.lock")
+    assert os.path.exists(path_in_use)
+    assert os.path.exists(f"{path_in_use}.lock")
+    cache.release(lock_in_use)
@@ -0,0 +1,278 @@
+import pytest
+
+from tracksuite.ecflow_client import (
+    CommandBatch,
+    SyncOperation,
+    SyncPlan,
+    diff_node_attributes,
+    diff_node_repeat,
+    diff_node_status,
+    plan_sync,
+)
+
+
+class StubAttribute:
+    def __init__(self, name, value):
+        self._name = name
+        self._value = value
+
+    def name(self):
+        return self._name
+
+    def name_or_number(self):
+        return self._name
+
+    def value(self):
+        return self._value
+
+    def __str__(self):
+        return f"{self._name} {self._value}"
+
+
+class StubRepeat:
+    # an empty repeat prints as an empty string, as ecflow.Repeat does
+    def __init__(self, value=None):
+        self._value = value
+
+    def value(self):
+        return self._value
+
+    def __str__(self):
+        return "" if self._value is None else f"repeat {self._value}"
+
+
+class StubNode:
+    def __init__(
+        self,
+        name,
+        nodes=(),
+        state="queued",
+        dstate=None,
+        defstatus="queued",
+        events=(),
+        meters=(),
+        repeat=None,
+    ):
+        self._name = name
+        self._parent = None
+        self.nodes = list(nodes)
+        for child in self.nodes:
+            child._parent = self
+        self._state = state
+        self._dstate = dstate or state
+        self._defstatus = defstatus
+        self.events = [StubAttribute(*event) for event in events]
+        self.meters = [StubAttribute(*meter) for meter in meters]
+        self.labels = []
+        self._repeat = StubRepeat(repeat)
+
+    def name(self):
+        return self._name
+
+    def get_abs_node_path(self):
+        parent = self._parent.get_abs_node_path() if self._parent else ""
+        return f"{parent}/{self._name}"
+
+    def get_state(self):
+        return self._state
+
+    def get_dstate(self):
+        return self._dstate
+
+    def get_defstatus(self):
+        return self._defstatus
+
+    def get_repeat(self):
+        return self._repeat
+
+
+class RecordingClient:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args):
+            self.calls.append((name,) + args)
+
+        return call
+
+
+def test_command_batch():
+    client = RecordingClient()
+    batch = CommandBatch(client, size=2)
+    batch.add("force_state", "/s/a", "complete")
+    batch.add("alter", "/s/a", "change", "event", "e", "set")
+    batch.add("force_state", "/s/b", "complete")
+    batch.add("force_state", "/s/c", "complete")
+    batch.add("force_state", "/s/d", "aborted")
+    batch.add("alter", "/s/b", "change", "event", "e", "set")
+    assert len(batch) == 6
+
+    assert batch.flush() == 4
+    assert client.calls == [
+        ("force_state", ["/s/a", "/s/b"], "complete"),
+        ("force_state", ["/s/c"], "complete"),
+        ("force_state", ["/s/d"], "aborted"),
+        ("alter", ["/s/a", "/s/b"], "change", "event", "e", "set"),
+    ]
+    assert len(batch) == 0
+    assert batch.flush() == 0
+
+
+def test_command_batch_order():
+    client = RecordingClient()
+    batch = CommandBatch(client)
+    # /s/a only needs a resume, /s/b must be complete before it is resumed
+    batch.add("resume", "/s/a")
+    batch.add("alter", "/s/b", "change", "defstatus", "complete")
+    batch.add("force_state", "/s/b", "complete")
+    batch.add("resume", "/s/b")
+    batch.add("suspend", "/s/c")
+    batch.flush()
+    assert client.calls == [
+        ("force_state", ["/s/b"], "complete"),
+        ("suspend", ["/s/c"]),
+        ("resume", ["/s/a", "/s/b"]),
+        ("alter", ["/s/b"], "change", "defstatus", "complete"),
+    ]
+
+
+def test_sync_plan(tmp_path):
+    plan = SyncPlan(
+        operations=[
+            SyncOperation("state", "/s/a", "complete"),
+            SyncOperation("attribute", "/s/a", True, "events", "e"),
+            SyncOperation("attribute", "/s/b", 3, "meters", "m"),
+            SyncOperation("attribute", "/s/b", 1, "meters", "n"),
+        ],
+        unmatched=["/s/new"],
+        skipped=5,
+    )
+    assert plan.counts() == {"state": 1, "events": 1, "meters": 2}
+
+    plan_file = str(tmp_path / "plan.json")
+    plan.write(plan_file)
+    assert SyncPlan.read(plan_file) == plan
+
+
+def test_command_batch_workers():
+    clients = []
+
+    def connect():
+        clients.append(RecordingClient())
+        return clients[-1]
+
+    batch = CommandBatch(RecordingClient(), size=10, workers=4, connect=connect)
+    for i in range(100):
+        batch.add("force_state", f"/s/{i}", "complete")
+    assert batch.flush() == 10
+    assert 1 <= len(clients) <= 4
+    calls = sorted(call for client in clients for call in client.calls)
+    assert sum(len(paths) for _, paths, _ in calls) == 100
+    assert batch.client.calls == []
+
+
+def test_diff_node_status_up_to_date():
+    new = StubNode("s", state="complete", defstatus="complete")
+    old = StubNode("s", state="complete", defstatus="complete")
+    assert diff_node_status(new, old) == ([], 3)
+
+
+def test_diff_node_status_unknown():
+    # a node loaded from a local definition has no state, its defstatus is compared
+    old = StubNode("s", state="complete", defstatus="complete")
+    new = StubNode("s", state="unknown", defstatus="complete")
+    assert diff_node_status(new, old) == ([], 3)
+
+    new = StubNode("s", state="unknown", dstate="queued")
+    operations, skipped = diff_node_status(new, old)
+    assert operations == [
+        SyncOperation("state", "/s", "complete"),
+        SyncOperation("defstatus", "/s", "complete"),
+    ]
+    assert skipped == 1
+
+
+def test_diff_node_status_suspended():
+    # only the suspended flag of the dstate matters, the rest follows the state
+    new = StubNode("s", state="complete", dstate="queued", defstatus="complete")
+    old = StubNode("s", state="complete", defstatus="complete")
+    assert diff_node_status(new, old) == ([], 3)
+
+    old = StubNode("s", state="complete", dstate="suspended", defstatus="complete")
+    new = StubNode("s", state="complete", defstatus="complete")
+    assert diff_node_status(new, old) == (
+        [SyncOperation("dstate", "/s", "suspended")],
+        2,
+    )
+    assert diff_node_status(old, new) == (
+        [SyncOperation("dstate", "/s", "complete")],
+        2,
+    )
+
+
+def test_diff_node_attributes():
+    new = StubNode("s", events=[("a", False), ("b", True)], meters=[("m", 0)])
+    old = StubNode(
+        "s", events=[("a", True), ("b", True), ("gone", True)], meters=[("m", 5)]
+    )
+    operations, skipped = diff_node_attributes(new, old, ["event", "meters"])
+    assert operations == [
+        SyncOperation("attribute", "/s", True, "events", "a"),
+        SyncOperation("attribute", "/s", 5, "meters", "m"),
+    ]
+    assert skipped == 1
+
+    with pytest.raises(ValueError, match="Unknown attribute"):
+        diff_node_attributes(new, old, ["triggers"])
+
+
+def test_diff_node_repeat():
+    assert diff_node_repeat(StubNode("s", repeat=3), StubNode("s")) == ([], 0)
+    assert diff_node_repeat(StubNode("s", repeat=3), StubNode("s", repeat=3)) == (
+        [],
+        1,
+    )
+    assert diff_node_repeat(StubNode("s", repeat=1), StubNode("s", repeat=3)) == (
+        [SyncOperation("repeat", "/s", "3")],
+        0,
+    )
+    assert diff_node_repeat(StubNode("s"), StubNode("s", repeat=3)) == (
+        [SyncOperation("repeat", "/s", "3")],
+        0,
+    )
+
+
+def test_plan_sync():
+    new = StubNode(
+        "s",
+        nodes=[
+            StubNode("f", nodes=[StubNode("t1"), StubNode("new")]),
+            StubNode("added"),
+        ],
+    )
+    old = StubNode(
+        "s",
+        nodes=[
+            StubNode(
+                "f",
+                nodes=[
+                    StubNode("t1", state="complete", events=[("e", True)]),
+                    StubNode("old"),
+                ],
+            ),
+            StubNode("removed", repeat=2),
+        ],
+    )
+    plan = plan_sync(new, old, attributes=["events"])
+    assert plan.operations == [SyncOperation("state", "/s/f/t1", "complete")]
+    # 3 status values for /s, /s/f and /s/f/t1, minus the state of /s/f/t1
+    assert plan.skipped == 8
+    assert plan.unmatched == ["/s/f/new", "/s/added"]
+    assert plan.removed == ["/s/f/old", "/s/removed"]
+
+    plan = plan_sync(new, old, skip_status=True)
+    assert plan.operations == []
+    assert plan.skipped == 0
+
+    assert plan_sync(new, StubNode("other")).unmatched == ["/s"]
@@ -0,0 +1,84 @@
+import json
+import os
+
+import git
+
+from tracksuite.fleet import (
+    deploy_entry,
+    init_entry,
+    read_inventory,
+    report,
+    run_fleet,
+    scan_staging,
+)
+
+
+def test_fleet_init_deploy(tmp_path, capsys):
+    user = os.getenv("USER")
+    (tmp_path / "file").write_text("not a folder")
+    inventory = tmp_path / "inventory.json"
+    inventory.write_text(
+        json.dumps(
+            [
+                {"host": "localhost", "user": user, "target": str(tmp_path / "t1")},
+                {"target": str(tmp_path / "t2"), "name": "second"},
+                {"target": str(tmp_path / "file" / "t3")},
+            ]
+        )
+    )
+    entries = read_inventory(inventory)
+    assert entries[1]["name"] == "second"
+    assert entries[1]["user"] == user
+
+    results = run_fleet(init_entry, entries, workers=2)
+    assert [result["status"] for result in results] == ["ok", "ok", "failed"]
+    assert results[0]["result"] == git.Repo(tmp_path / "t1").head.commit.hexsha
+    assert report(results) == 1
+    assert "2 succeeded, 1 failed" in capsys.readouterr().out
+
+    staging_dir = tmp_path / "staging"
+    staging_dir.mkdir()
+    (staging_dir / "suite.def").write_text("suite test")
+
+    def deploy(entry):
+        return deploy_entry(
+            entry, str(staging_dir), message="fleet", push=True, use_cache=False
+        )
+
+    results = run_fleet(deploy, entries[:2], workers=2)
+    assert report(results) == 0
+    for target in ["t1", "t2"]:
+        assert (tmp_path / target / "suite.def").read_text() == "suite test"
+        assert "fleet" in git.Repo(tmp_path / target).head.commit.message
+
+
+def test_fleet_scan_once(tmp_path, monkeypatch, mocker):
+    monkeypatch.setenv("TRACKSUITE_CACHE_DIR", str(tmp_path / "cache"))
+    inventory = tmp_path / "inventory.json"
+    inventory.write_text(
+        json.dumps([{"target": str(tmp_path / "t1")}, {"target": str(tmp_path / "t2")}])
+    )
+    entries = read_inventory(inventory)
+    run_fleet(init_entry, entries)
+
+    staging_dir = tmp_path / "staging"
+    staging_dir.mkdir()
+    (staging_dir / "suite.def").write_text("suite test")
+    (staging_dir / "task.ecf").write_text("echo")
+
+    staged = scan_staging(str(staging_dir))
+    assert sorted(staged) == ["suite.def", "task.ecf"]
+    # the targets only compare the staged files with their index
+    scan = mocker.patch("tracksuite.deploy.StagingManifest.scan")
+
+    def deploy(entry):
+        return deploy_entry(
+            entry, str(staging_dir), push=True, use_cache=False, staged=staged
+        )
+
+    results = run_fleet(deploy, entries)
+    assert report(results) == 0
+    scan.assert_not_called()
+    assert sorted(staged) == ["suite.def", "task.ecf"]
+    for target in ["t1", "t2"]:
+        assert (tmp_path / target / "task.ecf").read_text() == "echo"
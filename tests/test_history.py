@@ -0,0 +1,129 @@
+import os
+import tempfile
+
+import git
+import pytest
+
+from tracksuite.deploy import GitDeployment
+from tracksuite.history import DeploymentHistory
+from tracksuite.init import setup_remote
+from tracksuite.repos import GitRepositories
+
+
+@pytest.fixture
+def git_deployment():
+    temp_dir = tempfile.TemporaryDirectory().name
+    staging_dir = os.path.join(temp_dir, "staging")
+    target_repo = os.path.join(temp_dir, "target")
+    current_user = os.getenv("USER")
+    setup_remote(
+        host="localhost",
+        user=current_user,
+        target_dir=target_repo,
+    )
+
+    deployer = GitDeployment(
+        host="localhost",
+        user=current_user,
+        staging_dir=staging_dir,
+        target_repo=target_repo,
+    )
+
+    return deployer
+
+
+def deploy_file(deployer, path, content, message):
+    fullpath = os.path.join(deployer.staging_dir, path)
+    os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+    with open(fullpath, "w") as f:
+        f.write(content)
+    deployer.pull_remotes()
+    deployer.deploy(message)
+
+
+def test_history_query(git_deployment, tmp_path):
+    deployer = git_deployment
+    os.mkdir(deployer.staging_dir)
+    deploy_file(deployer, "suite/a.ecf", "a", "first change")
+    deploy_file(deployer, "suite/family/b.ecf", "b", "second change")
+
+    history = DeploymentHistory(deployer.repo, str(tmp_path / "history.sqlite"))
+    assert history.update() == len(list(deployer.repo.iter_commits()))
+    assert history.update() == 0
+
+    deployments = history.query(staging_dir=deployer.staging_dir)
+    assert [entry["message"] for entry in deployments] == [
+        "second change",
+        "first change",
+    ]
+    assert deployments[0]["staging_dir"] == deployer.staging_dir
+    assert deployments[0]["files"] == ["suite/family/b.ecf"]
+
+    assert deployments[0]["deploy_user"] == str(deployer.deploy_user)
+    assert len(history.query(staging_dir=deployer.staging_dir, limit=1)) == 1
+    assert history.query(user="nobody") == []
+    assert [e["message"] for e in history.query(path="suite/family")] == [
+        "second change"
+    ]
+    assert [e["message"] for e in history.query(path="suite/*.ecf")] == ["first change"]
+    assert len(history.query(path="**/*.ecf")) == 2
+
+    # the index is only updated with the new commits
+    deploy_file(deployer, "suite/a.ecf", "a2", "third change")
+    assert history.update() == 1
+    assert [e["message"] for e in history.query(path="suite/a.ecf")] == [
+        "third change",
+        "first change",
+    ]
+    since = deployer.repo.head.commit.committed_date
+    assert history.query(since=since + 1) == []
+    assert history.query(until=since - 3600) == []
+    assert len(history.query(since=since - 3600, until=since)) == 4
+
+    # a rewritten history is indexed again
+    deployer.repo.git.reset("--hard", "HEAD~1")
+    deployer.repo.index.commit("other change")
+    history.update()
+    assert "third change" not in [e["message"] for e in history.query()]
+    history.close()
+
+
+def test_history_shallow_clone(git_deployment, tmp_path):
+    deployer = git_deployment
+    os.mkdir(deployer.staging_dir)
+    deploy_file(deployer, "suite/a.ecf", "a", "first change")
+    deploy_file(deployer, "suite/b.ecf", "b", "second change")
+
+    repos = GitRepositories(
+        host="localhost",
+        user=deployer.user,
+        target_repo=deployer.target_dir,
+        clone_mode="shallow",
+    )
+    assert repos.is_shallow()
+    repos.unshallow()
+    assert not repos.is_shallow()
+
+    history = DeploymentHistory(repos.repo, str(tmp_path / "history.sqlite"))
+    assert history.update() == len(list(deployer.repo.iter_commits()))
+    assert len(history.query(staging_dir=deployer.staging_dir)) == 2
+    history.close()
+
+
+def test_history_unknown_tip(git_deployment, tmp_path):
+    deployer = git_deployment
+    os.mkdir(deployer.staging_dir)
+    deploy_file(deployer, "suite/a.ecf", "a", "first change")
+
+    # the index was built from another history, whose tip is not in this clone
+    index_path = str(tmp_path / "history.sqlite")
+    other = git.Repo.init(str(tmp_path / "other"))
+    other.index.commit("unrelated commit")
+    history = DeploymentHistory(other, index_path)
+    assert history.update() == 1
+    history.close()
+
+    history = DeploymentHistory(deployer.repo, index_path)
+    assert history.update() == len(list(deployer.repo.iter_commits()))
+    assert "unrelated commit" not in [e["message"] for e in history.query()]
+    history.close()
@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def imported_modules(module):
+    """
+    Returns the heavy dependencies imported by a module, in a fresh interpreter.
+    """
+    code = (
+        f"import sys, {module}; "
+        + "print(' '.join(m for m in ('git', 'ecflow', 'asyncio') if m in sys.modules))"
+    )
+    ret = subprocess.run(
+        [sys.executable, "-c", code],
+        check=True,
+        stdout=subprocess.PIPE,
+        encoding="utf8",
+        env=dict(os.environ, PYTHONPATH=ROOT),
+    )
+    return ret.stdout.split()
+
+
+@pytest.mark.parametrize(
+    "module, expected",
+    [
+        ("tracksuite", []),
+        ("tracksuite.print", ["ecflow"]),
+        ("tracksuite.replace", ["ecflow"]),
+        ("tracksuite.deploy", ["git"]),
+        ("tracksuite.revert", ["git"]),
+        ("tracksuite.init", ["git"]),
+    ],
+)
+def test_import_dependencies(module, expected):
+    modules = set(imported_modules(module))
+    # ecflow is optional, it is only imported if installed
+    if "ecflow" not in expected:
+        assert "ecflow" not in modules
+    assert modules - {"ecflow"} == set(expected) - {"ecflow"}
+
+
+def test_lazy_public_api():
+    import tracksuite
+
+    assert tracksuite.GitDeployment.__name__ == "GitDeployment"
+    assert callable(tracksuite.setup_remote)
+    assert "GitRevert" in dir(tracksuite)
+    with pytest.raises(AttributeError):
+        tracksuite.unknown
@@ -5,7 +5,14 @@ from unittest.mock import patch
 import git
 import pytest
 
-from tracksuite.init import LocalHostClient, SSHClient, setup_remote
+import tracksuite.ssh
+from tracksuite.init import LocalHostClient, SSHClient, init_target, setup_remote
+from tracksuite.ssh import (
+    SSHConnectionPool,
+    get_git_environment,
+    get_ssh_pool,
+    is_ssh_url,
+)
 
 
 @pytest.fixture
@@ -30,7 +37,10 @@ def test_ssh_client_exec(ssh_client, mock_run_cmd_returns_input):
     result = ssh_client.exec(command_to_execute)
 
     # Assert that the mock was called with the expected command
-    expected_ssh_command = f'ssh test_user@test_host "{command_to_execute[0]}; "'
+    ssh_command = get_ssh_pool().ssh_command()
+    expected_ssh_command = (
+        f'{ssh_command} test_user@test_host "{command_to_execute[0]}; "'
+    )
     mock_run_cmd_returns_input.assert_called_with(expected_ssh_command)
 
     # Assert that the result is what our side_effect function returns
@@ -59,6 +69,37 @@ def test_ssh_client_is_path(ssh_client, mock_run_cmd_returns_true):
     assert result is True
 
 
+def test_ssh_connection_pool(monkeypatch):
+    monkeypatch.setenv("GIT_SSH_COMMAND", "ssh -i key")
+    pool = SSHConnectionPool()
+    control_path = os.path.join(pool._get_control_dir(), "%C")
+    assert pool.ssh_command().startswith("ssh -o ControlMaster=auto")
+    assert f"ControlPath={control_path}" in pool.ssh_command()
+    git_ssh_command = pool.git_environment()["GIT_SSH_COMMAND"]
+    assert git_ssh_command.startswith("ssh -i key -o ControlMaster=auto")
+
+    control_dir = pool.control_dir
+    pool.close()
+    assert not os.path.exists(control_dir)
+    pool.close()
+
+
+def test_git_environment(monkeypatch):
+    for url in ["ssh://user@host:/path", "user@host:path", "host:path"]:
+        assert is_ssh_url(url)
+    for url in ["/tmp/target", "relative/a:b", "https://host/repo.git", None]:
+        assert not is_ssh_url(url)
+
+    # the pool is only created when git goes through ssh
+    monkeypatch.setattr("tracksuite.ssh._pool", None)
+    assert get_git_environment("/tmp/target", None) == {}
+    assert tracksuite.ssh._pool is None
+    env = get_git_environment("/tmp/target", "user@host:backup.git")
+    assert "ControlMaster=auto" in env["GIT_SSH_COMMAND"]
+    assert tracksuite.ssh._pool is not None
+    tracksuite.ssh._pool.close()
+
+
 def test_localhost_client_different_user():
     with pytest.raises(Exception):
         LocalHostClient("localhost", "invalid_user")
@@ -107,6 +148,28 @@ def test_setup_remote():
             assert "first commit" in commit.message
 
 
+def test_setup_remote_status():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        remote_path = os.path.join(temp_dir, "remote")
+        current_user = os.getenv("USER")
+        commit = setup_remote(
+            host="localhost",
+            user=current_user,
+            target_dir=remote_path,
+        )
+        assert git.Repo(remote_path).head.commit.hexsha == commit
+
+        client = LocalHostClient("localhost", current_user)
+        assert init_target(client, remote_path)["status"] == "exists"
+        with pytest.raises(Exception, match="already initialised"):
+            setup_remote("localhost", current_user, remote_path)
+
+        # mkdir fails below a file, its error message is kept in the status
+        status = init_target(client, os.path.join(remote_path, "dummy.txt", "sub"))
+        assert status["status"] == "error"
+        assert "dummy.txt" in status["output"]
+
+
 def test_setup_remote_with_backup():
     with tempfile.TemporaryDirectory() as temp_dir:
         repo_path = os.path.join(temp_dir, "my_repo.git")
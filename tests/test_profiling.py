@@ -0,0 +1,39 @@
+import pstats
+
+from tracksuite.print import get_parser
+from tracksuite.profiling import profiled
+
+
+@profiled
+def dummy_main(args=None):
+    return sum(i * i for i in range(1000))
+
+
+def test_profile_disabled():
+    assert dummy_main(["node"]) == 332833500
+
+
+def test_profile_cpu(tmp_path):
+    output = tmp_path / "profile.pstats"
+    assert dummy_main(["--profile", "--profile-output", str(output)]) == 332833500
+    stats = pstats.Stats(str(output))
+    assert any(name == "dummy_main" for _, _, name in stats.stats)
+
+
+def test_profile_mem(tmp_path):
+    output = tmp_path / "profile.txt"
+    dummy_main(
+        ["node", "--profile", "--profile-mode", "mem", "--profile-output", str(output)]
+    )
+    assert output.read_text().startswith("Peak traced memory:")
+
+
+def test_profile_arguments():
+    args = get_parser().parse_args(["node", "--profile"])
+    assert args.profile and args.profile_mode == "cpu"
+    # the positional argument is never taken as a profile mode
+    args = get_parser().parse_args(["--profile", "/suite"])
+    assert args.profile and args.node == "/suite"
+    args = get_parser().parse_args(["--profile", "--profile-mode=mem", "node"])
+    assert args.profile_mode == "mem"
+    assert not get_parser().parse_args(["node"]).profile
@@ -5,7 +5,7 @@ import pytest
 
 from tracksuite.deploy import GitDeployment
 from tracksuite.init import setup_remote
-from tracksuite.revert import GitRevert
+from tracksuite.revert import GitRevert, parse_state
 
 
 @pytest.fixture
@@ -64,3 +64,103 @@ def test_deploy_default(git_deployment):
     latest_commit = deployer.repo.head.commit
     assert "Revert to first commit" in latest_commit.message
     assert not os.path.exists(os.path.join(deployer.target_dir, "dummy2.txt"))
+
+
+def test_revert_shallow(git_deployment):
+    deployer, _ = git_deployment
+    staging_dir = deployer.staging_dir
+
+    os.mkdir(staging_dir)
+    for i in [1, 2]:
+        with open(os.path.join(staging_dir, f"dummy{i}.txt"), "w") as f:
+            f.write(f"dummy content {i}")
+        deployer.pull_remotes()
+        deployer.deploy(f"This is my change {i}")
+
+    reverter = GitRevert(
+        deployer.target_dir,
+        host="localhost",
+        user=deployer.user,
+        clone_mode="shallow",
+    )
+    assert reverter.is_shallow()
+    assert len(list(reverter.repo.iter_commits())) == 1
+
+    hash_init = reverter.check_repos()
+    reverter.revert(1, "Revert to first commit")
+    reverter.push_to_remotes(expected=hash_init)
+
+    deployer.pull_remotes()
+    assert "Revert to first commit" in deployer.repo.head.commit.message
+    assert not os.path.exists(os.path.join(deployer.target_dir, "dummy2.txt"))
+
+
+def test_revert_to_hash(git_deployment):
+    deployer, reverter = git_deployment
+    staging_dir = deployer.staging_dir
+
+    os.mkdir(staging_dir)
+    hashes = []
+    for i in [1, 2, 3]:
+        with open(os.path.join(staging_dir, f"dummy{i}.txt"), "w") as f:
+            f.write(f"dummy content {i}")
+        deployer.pull_remotes()
+        deployer.deploy(f"This is my change {i}")
+        hashes.append(deployer.repo.head.commit.hexsha)
+
+    reverter.pull_remotes()
+    n_commits = len(list(reverter.repo.iter_commits()))
+    assert reverter.resolve_target(2).hexsha == hashes[0]
+    assert reverter.resolve_target(n_commits - 1).hexsha != hashes[0]
+    with pytest.raises(Exception, match="less than"):
+        reverter.resolve_target(n_commits)
+
+    reverter.repo.create_tag("v1", ref=hashes[0])
+    assert reverter.resolve_target("v1").hexsha == hashes[0]
+
+    hash_init = reverter.check_repos()
+    reverter.revert(hashes[1][:10], "Revert to second commit")
+    reverter.push_to_remotes(expected=hash_init)
+
+    deployer.pull_remotes()
+    assert "Revert to second commit" in deployer.repo.head.commit.message
+    assert os.path.exists(os.path.join(deployer.target_dir, "dummy2.txt"))
+    assert not os.path.exists(os.path.join(deployer.target_dir, "dummy3.txt"))
+
+
+def test_parse_state():
+    assert parse_state("3") == 3
+    assert parse_state("1234567") == "1234567"
+    assert parse_state("v1.0") == "v1.0"
+
+
+def test_revert_restore(git_deployment):
+    deployer, reverter = git_deployment
+    staging_dir = deployer.staging_dir
+
+    os.mkdir(staging_dir)
+    hashes = []
+    for i in [1, 2, 3]:
+        with open(os.path.join(staging_dir, f"dummy{i}.txt"), "w") as f:
+            f.write(f"dummy content {i}")
+        deployer.pull_remotes()
+        deployer.deploy(f"This is my change {i}")
+        hashes.append(deployer.repo.head.commit.hexsha)
+
+    reverter.pull_remotes()
+    head = reverter.repo.head.commit.hexsha
+    preview = reverter.preview(2)
+    assert "dummy2.txt" in preview and "dummy3.txt" in preview
+    assert reverter.repo.head.commit.hexsha == head
+    assert not reverter.repo.is_dirty(untracked_files=True)
+
+    hash_init = reverter.check_repos()
+    reverter.revert(2, "Restore first commit", mode="restore")
+    reverter.push_to_remotes(expected=hash_init)
+
+    deployer.pull_remotes()
+    assert "Restore first commit" in deployer.repo.head.commit.message
+    assert deployer.repo.head.commit.parents[0].hexsha == head
+    assert deployer.repo.head.commit.tree == deployer.repo.commit(hashes[0]).tree
+    assert not os.path.exists(os.path.join(deployer.target_dir, "dummy2.txt"))
+    assert not os.path.exists(os.path.join(deployer.target_dir, "dummy3.txt"))
@@ -0,0 +1,64 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+from tracksuite.utils import CmdError, run_cmd, run_cmd_async, stream_cmd
+
+
+def test_stream_cmd():
+    lines = list(stream_cmd("echo one; echo two >&2; cat", input="three\n"))
+    assert lines == ["one", "two", "three"]
+
+
+def test_stream_cmd_error_tail():
+    with pytest.raises(CmdError) as exc:
+        for _ in stream_cmd("seq 1 1000; exit 3", tail_lines=5):
+            pass
+    message = str(exc.value)
+    assert "(3)" in message
+    assert "996\n997\n998\n999\n1000" in message
+    assert "\n995\n" not in message
+
+
+def test_stream_cmd_timeout():
+    start = time.time()
+    with pytest.raises(CmdError, match="timeout"):
+        list(stream_cmd("echo start; sleep 10", timeout=0.5))
+    assert time.time() - start < 5
+
+
+def test_stream_cmd_session():
+    # commands keep the caller session, and its terminal, unless asked otherwise
+    cmd = f"{sys.executable} -c 'import os; print(os.getsid(0))'"
+    assert list(stream_cmd(cmd)) == [str(os.getsid(0))]
+    assert list(stream_cmd(cmd, new_session=True)) != [str(os.getsid(0))]
+
+
+def test_run_cmd_async():
+    async def run_all():
+        return await asyncio.gather(
+            *[run_cmd_async(f"sleep 0.5; echo {i}") for i in range(5)]
+        )
+
+    start = time.time()
+    results = asyncio.run(run_all())
+    assert [ret.stdout for ret in results] == [f"{i}\n" for i in range(5)]
+    assert time.time() - start < 2.5
+
+    with pytest.raises(CmdError, match="timeout"):
+        asyncio.run(run_cmd_async("sleep 10", timeout=0.5))
+    with pytest.raises(CmdError, match="error"):
+        asyncio.run(run_cmd_async("echo failed; exit 1"))
+
+
+def test_run_cmd_full_output():
+    # the whole output is returned, only the error message is limited to the tail
+    expected = "".join(f"{i}\n" for i in range(1, 501))
+    assert run_cmd("seq 1 500", tail_lines=5).stdout == expected
+    assert asyncio.run(run_cmd_async("seq 1 500", tail_lines=5)).stdout == expected
+    assert run_cmd("cat", input="a\nb").stdout == "a\nb\n"
+    with pytest.raises(CmdError, match="error"):
+        run_cmd("exit 2")
@@ -11,10 +11,30 @@ warnings.formatwarning = (
 )
 warn = warnings.warn
 
-from .deploy import GitDeployment
-from .init import setup_remote
-from .replace import replace_on_server
-from .revert import GitRevert
+import importlib
+
+# the public classes and functions are imported on first access, so that each
+# command line tool only imports what it uses (GitPython, ecflow)
+_LAZY_IMPORTS = {
+    "GitDeployment": ".deploy",
+    "setup_remote": ".init",
+    "replace_on_server": ".replace",
+    "GitRevert": ".revert",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        module = importlib.import_module(_LAZY_IMPORTS[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_IMPORTS))
+
 
 try:
     # NOTE: the `_version.py` file must not be present in the git repository
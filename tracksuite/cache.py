@@ -0,0 +1,158 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import time
+
+from tracksuite import LOGGER as log
+
+DEFAULT_MAX_AGE = 30 * 24 * 3600  # 30 days
+DEFAULT_MAX_SIZE = 10 * 1024**3  # 10 GB
+EVICTION_INTERVAL = 24 * 3600  # once a day
+
+
+def get_cache_dir():
+    """
+    Returns the directory where tracksuite keeps its cached clones.
+    Defaults to $XDG_CACHE_HOME/tracksuite, can be overridden with $TRACKSUITE_CACHE_DIR.
+    """
+    cache_home = os.getenv("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.getenv("TRACKSUITE_CACHE_DIR") or os.path.join(cache_home, "tracksuite")
+
+
+def get_dir_size(path):
+    """
+    Returns the total size in bytes of the files in a directory.
+    """
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def get_cache_key(user, host, target_repo):
+    """
+    Returns the name of the cache entry for a target repository.
+    """
+    name = os.path.basename(target_repo.rstrip("/")) or "root"
+    digest = hashlib.sha1(f"{user}@{host}:{target_repo}".encode()).hexdigest()
+    return f"{name}-{digest[:16]}"
+
+
+class CloneCache:
+    def __init__(
+        self, cache_dir=None, max_age=DEFAULT_MAX_AGE, max_size=DEFAULT_MAX_SIZE
+    ):
+        """
+        Cache of local clones of target repositories, reused between invocations.
+        Each clone is protected by a lock file so that concurrent invocations
+        never work on the same clone.
+
+        Parameters:
+            cache_dir(str): Directory of the cache (optional).
+            max_age(int): Clones unused for longer than max_age seconds are evicted.
+            max_size(int): Oldest clones are evicted when the cache exceeds max_size bytes.
+        """
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.max_age = max_age
+        self.max_size = max_size
+
+    def acquire(self, user, host, target_repo):
+        """
+        Lock the cache entry of a target repository.
+
+        Parameters:
+            user(str): The deploying user.
+            host(str): The target host.
+            target_repo(str): Path to the target repository on the target host.
+
+        Returns:
+            The path of the cached clone (which might not exist yet) and the lock file,
+            or (None, None) if the entry is already used by another invocation.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.evict()
+
+        path = os.path.join(self.cache_dir, get_cache_key(user, host, target_repo))
+        lock = self._try_lock(path)
+        if lock is None:
+            log.info(f"    -> Cached clone {path} is in use")
+            return None, None
+        os.utime(lock.name)
+        return path, lock
+
+    def release(self, lock):
+        """
+        Release the lock on a cache entry.
+        """
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+    def evict(self):
+        """
+        Remove the cached clones that are too old, then the oldest ones
+        until the cache is below its maximum size.
+        Runs at most once per EVICTION_INTERVAL, entries in use are never removed.
+        """
+        stamp = os.path.join(self.cache_dir, ".last_eviction")
+        now = time.time()
+        if os.path.exists(stamp) and now - os.path.getmtime(stamp) < EVICTION_INTERVAL:
+            return
+        with open(stamp, "w"):
+            pass
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            lock_path = f"{path}.lock"
+            last_used = (
+                os.path.getmtime(lock_path)
+                if os.path.exists(lock_path)
+                else os.path.getmtime(path)
+            )
+            entries.append((last_used, path))
+
+        # keep the most recently used clones first
+        total_size = 0
+        for last_used, path in sorted(entries, reverse=True):
+            size = get_dir_size(path)
+            if now - last_used > self.max_age or total_size + size > self.max_size:
+                if self._remove(path):
+                    continue
+            total_size += size
+
+    def _try_lock(self, path):
+        lock_path = f"{path}.lock"
+        while True:
+            lock = open(lock_path, "a")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                return None
+            # the lock file may have been removed by an eviction while we were waiting for it
+            try:
+                if os.fstat(lock.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    return lock
+            except FileNotFoundError:
+                pass
+            self.release(lock)
+
+    def _remove(self, path):
+        lock = self._try_lock(path)
+        if lock is None:
+            return False
+        log.info(f"    -> Evicting cached clone {path}")
+        shutil.rmtree(path, ignore_errors=True)
+        # removed under the lock, the next invocation creates a new lock file
+        os.remove(lock.name)
+        self.release(lock)
+        return True
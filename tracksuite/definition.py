@@ -3,7 +3,9 @@ import os
 
 from tracksuite import LOGGER, warn
 from tracksuite.ecflow_client import EcflowClient, save_definition
-from tracksuite.repos import GitRepositories
+from tracksuite.metrics import add_metrics_arguments, record
+from tracksuite.profiling import add_profile_arguments, profiled
+from tracksuite.repos import CLONE_MODES, GitRepositories
 
 
 def update_definition_from_server(
@@ -15,6 +17,7 @@ def update_definition_from_server(
     target: str,
     backup: str,
     local: str,
+    clone_mode: str = "full",
 ):
     """
     Update the suite definition on the target repository.
@@ -36,6 +39,7 @@ def update_definition_from_server(
         target_repo=target,
         backup_repo=backup,
         local_repo=local,
+        clone_mode=clone_mode,
     )
 
     if definition is None:
@@ -62,17 +66,7 @@ def update_definition_from_server(
         LOGGER.info("Nothing to commit... aborting")
         return False
 
-    hash_check = deployer.get_hash_remote("target")
-    if hash_check != hash_init:
-        raise Exception(
-            "Remote repositories have changed during deployment!\n \
-            Please check the state of the remote repositories"
-        )
-
-    deployer.push("target")
-    if deployer.backup_repo:
-        LOGGER.info(f"    -> Git push to backup repository {deployer.backup_repo}")
-        deployer.push("backup")
+    deployer.push_to_remotes(expected=hash_init)
 
 
 def get_parser():
@@ -90,22 +84,33 @@ def get_parser():
     parser.add_argument("--host", default=os.getenv("HOSTNAME"), help="Target host")
     parser.add_argument("--user", default=os.getenv("USER"), help="Deploy user")
     parser.add_argument("--port", default=3141, help="Ecflow port")
+    parser.add_argument(
+        "--clone-mode",
+        default="full",
+        choices=CLONE_MODES,
+        help="How to clone the target repository (full, shallow or blobless)",
+    )
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
     return parser
 
 
+@profiled
 def main(args=None):
     parser = get_parser()
     args = parser.parse_args()
-    update_definition_from_server(
-        name=args.name,
-        definition=args.definition,
-        user=args.user,
-        host=args.host,
-        port=args.port,
-        target=args.target,
-        backup=args.backup,
-        local=args.local,
-    )
+    with record("update-defs", args.metrics, LOGGER):
+        update_definition_from_server(
+            name=args.name,
+            definition=args.definition,
+            user=args.user,
+            host=args.host,
+            port=args.port,
+            target=args.target,
+            backup=args.backup,
+            local=args.local,
+            clone_mode=args.clone_mode,
+        )
 
 
 if __name__ == "__main__":
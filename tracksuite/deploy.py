@@ -1,10 +1,22 @@
 import argparse
+import json
 import os
-from filecmp import dircmp
+import shutil
+import tempfile
 
 from tracksuite import LOGGER as log
-from tracksuite.repos import GitRepositories
-from tracksuite.utils import run_cmd
+from tracksuite.metrics import add_metrics_arguments, excluded, record, span
+from tracksuite.profiling import add_profile_arguments, profiled
+from tracksuite.repos import CLONE_MODES, GitRepositories, RemoteMovedError
+from tracksuite.staging import (
+    MANIFEST_NAME,
+    StagingDiff,
+    StagingManifest,
+    match_path,
+)
+
+# maximum number of paths passed to a single git command
+PATH_BATCH_SIZE = 1000
 
 
 class GitDeployment(GitRepositories):
@@ -16,6 +28,9 @@ class GitDeployment(GitRepositories):
         local_repo=None,
         target_repo=None,
         backup_repo=None,
+        use_cache=False,
+        clone_mode="full",
+        direct=False,
     ):
         """
         Class used to deploy suites through git.
@@ -27,6 +42,10 @@ class GitDeployment(GitRepositories):
             local_repo(str): Path to the local repository.
             target_repo(str): Path to the target repository on the target host.
             backup_repo(str): URL of the backup repository.
+            use_cache(bool): Reuse a cached clone of the target if local_repo is not given.
+            clone_mode(str): How to clone the target: "full", "shallow" or "blobless".
+            direct(bool): Commit directly from the staging directory, the local repository
+                is only used as index and object store and its files are never written.
         """
         super().__init__(
             host=host,
@@ -34,13 +53,39 @@ class GitDeployment(GitRepositories):
             target_repo=target_repo,
             backup_repo=backup_repo,
             local_repo=local_repo,
+            use_cache=use_cache,
+            clone_mode=clone_mode,
+            checkout=not direct,
         )
 
         self.staging_dir = staging_dir
         if self.staging_dir is None:
             raise Exception("Staging directory not specified")
+        self.direct = direct
+
+    def _git(self, work_tree=None):
+        """
+        Returns the git command of the local repository, optionally run on another work tree.
+        """
+        if work_tree:
+            return self.repo.git(work_tree=os.path.abspath(work_tree))
+        return self.repo.git
+
+    def add(self, files=None, work_tree=None):
+        """
+        Adds files to the index of the local repository.
 
-    def commit(self, message=None, files=None):
+        Parameters:
+            files(list): optional list of files to add, everything by default
+            work_tree(str): optional directory to add the files from, instead of the local repository
+        """
+        if files is None:
+            self._git(work_tree).add("--all")
+            return
+        for i in range(0, len(files), PATH_BATCH_SIZE):
+            self._git(work_tree).add("--", *files[i : i + PATH_BATCH_SIZE])
+
+    def commit(self, message=None, files=None, work_tree=None, expected_diff=None):
         """
         Commits the current stage of the local repository.
         Throws exception if there is nothing to commit.
@@ -49,145 +94,332 @@ class GitDeployment(GitRepositories):
 
         Parameters:
             message(str): optional git commit message to append to default message
+            files(list): optional list of files to commit, everything by default
+            work_tree(str): optional directory to add the files from, instead of the local repository
+            expected_diff(StagingDiff): optional changes the index must match before committing
         """
-        if files is None:
-            files = "--all"
         try:
             commit_message = f"deployed by {self.deploy_user} from {self.deploy_host}:{self.staging_dir}\n"
             if message:
                 commit_message += message
-            self.repo.git.add(files)
-            diff = self.repo.index.diff(self.repo.commit())
-            if diff:
+            with span("commit"):
+                self.add(files, work_tree)
+                if expected_diff is not None:
+                    self.check_index(expected_diff, files)
+                diff = self.repo.index.diff(self.repo.commit())
+                if not diff:
+                    return False
                 self.repo.index.commit(commit_message)
-            else:
-                return False
         except Exception as e:
             log.info("Commit failed!")
             raise e
         return True
 
-    def diff_staging(self):
-        """
-        Prints the difference between the staged suite and the current suite
-        """
-        modified = []
-        removed = []
-        added = []
-
-        def get_diff_files(dcmp, root=""):
-            for name in dcmp.diff_files:
-                path = os.path.join(root, name)
-                modified.append(path)
-            for name in dcmp.left_only:
-                path = os.path.join(root, name)
-                fullpath = os.path.join(self.staging_dir, path)
-                if os.path.isdir(fullpath):
-                    for root_dir, dirs, files in os.walk(fullpath):
-                        for file in files:
-                            filepath = os.path.relpath(
-                                os.path.join(root, root_dir, file), self.staging_dir
-                            )
-                            added.append(filepath)
-                else:
-                    added.append(path)
-            for name in dcmp.right_only:
-                path = os.path.join(root, name)
-                fullpath = os.path.join(self.target_dir, path)
-                if os.path.isdir(fullpath):
-                    for root_dir, dirs, files in os.walk(fullpath):
-                        for file in files:
-                            filepath = os.path.relpath(
-                                os.path.join(root, root_dir, file), self.target_dir
-                            )
-                            removed.append(filepath)
-                else:
-                    removed.append(path)
-            for dir, sub_dcmp in dcmp.subdirs.items():
-                get_diff_files(sub_dcmp, root=os.path.join(root, dir))
-
-        diff = dircmp(self.staging_dir, self.local_dir)
-        log.info("Changes in staged suite:")
-        get_diff_files(diff)
-        changes = [
-            ("Removed", removed),
-            ("Added", added),
-            ("Modified", modified),
+    def check_index(self, diff, files=None):
+        """
+        Check that the index of the local repository contains exactly the changes of a diff,
+        i.e. that the staged suite has not changed since the diff was computed.
+
+        Parameters:
+            diff(StagingDiff): the expected changes.
+            files(list): optional list of files to check, all the files of the diff by default.
+        """
+        entries = {
+            path: entry.hexsha
+            for (path, stage), entry in self.repo.index.entries.items()
+        }
+        selected = set(files) if files is not None else None
+        changed = [
+            path
+            for path, hexsha in diff.hashes.items()
+            if (selected is None or path in selected) and entries.get(path) != hexsha
+        ]
+        changed += [
+            path
+            for path in diff.deleted_paths()
+            if (selected is None or path in selected) and path in entries
         ]
-        for name, files in changes:
-            if files:
-                log.info(f"    - {name}:")
-                for path in files:
-                    log.info(f"        - {path}")
-        log.info("For more details, compare the following folders:")
-        log.info(self.staging_dir)
-        log.info(self.local_dir)
+        if changed:
+            raise Exception(
+                "Staged suite has changed since the changes were computed:\n"
+                + "\n".join(f"    - {path}" for path in changed)
+            )
+
+    def diff_staging(self, files=None, staged=None):
+        """
+        Computes and logs the difference between the staged suite and the current suite.
+        The staged files are compared with the index of the local repository through
+        their git blob hashes, kept in a manifest so that only the files whose stat changed
+        are hashed again. Files ignored by git are left out.
+
+        Parameters:
+            files(list): optional glob patterns of the files to compare, everything by default.
+                Only the matching files of the staged suite are scanned.
+            staged(dict): optional staged files already scanned with the same patterns,
+                path -> (git mode, git blob hash, size), see StagingManifest.scan.
+
+        Returns:
+            StagingDiff: the added, removed, modified and renamed files.
+        """
+        # start from a clean index, leftovers of a failed deployment are discarded
+        # (the whole working tree is only checked for full deployments)
+        if self.direct or files is not None:
+            if self.repo.index.diff("HEAD"):
+                self.repo.git.reset("-q")
+        elif self.repo.is_dirty(untracked_files=True):
+            log.info("    -> Discarding local changes in the local repository")
+            self.repo.git.reset("--hard")
+            self.repo.git.clean("-ffdx")
+
+        with span("diff") as diff_span:
+            if staged is None:
+                manifest = StagingManifest(
+                    self.staging_dir, os.path.join(self.repo.git_dir, MANIFEST_NAME)
+                )
+                staged = manifest.scan(files)
+                manifest.save()
+            else:
+                # the ignored files are removed below, the caller's copy is left as is
+                staged = dict(staged)
+            indexed = {
+                path: (entry.mode, entry.hexsha, entry.size)
+                for (path, stage), entry in self.repo.index.entries.items()
+                if files is None or any(match_path(path, pattern) for pattern in files)
+            }
+            untracked = [path for path in staged if path not in indexed]
+            for path in self._ignored_paths(untracked):
+                del staged[path]
+            diff = StagingDiff.compare(staged, indexed)
+            diff_span.bytes = sum(size for mode, hexsha, size in staged.values())
+        diff.log()
+        return diff
+
+    def _ignored_paths(self, paths):
+        """
+        Returns the paths of the staged suite ignored by git.
+        """
+        if not paths:
+            return set()
+        with tempfile.TemporaryFile() as paths_file:
+            paths_file.write(b"".join(os.fsencode(path) + b"\0" for path in paths))
+            paths_file.seek(0)
+            status, output, error = self._git(self.staging_dir).check_ignore(
+                "--stdin",
+                "-z",
+                istream=paths_file,
+                with_extended_output=True,
+                with_exceptions=False,
+            )
+        # check-ignore returns 1 if none of the paths are ignored
+        if status not in (0, 1):
+            raise Exception(f"Could not check ignored files: {error}")
+        return set(path for path in output.split("\0") if path)
+
+    def sync_staging(self, diff=None):
+        """
+        Copies the staged suite to the local repository.
+        Only the added, modified, renamed and removed files are touched.
+
+        Parameters:
+            diff(StagingDiff): optional precomputed difference, computed by default.
+
+        Returns:
+            StagingDiff: the changes applied to the local repository.
+        """
+        if diff is None:
+            diff = self.diff_staging()
+
+        with span("stage", bytes=diff.added_bytes + diff.modified_bytes):
+            for path in diff.deleted_paths():
+                self._remove_local_file(path)
+            for path in diff.new_paths():
+                source = os.path.join(self.staging_dir, path)
+                destination = os.path.join(self.local_dir, path)
+                if os.path.isdir(destination) and not os.path.islink(destination):
+                    shutil.rmtree(destination)
+                elif os.path.lexists(destination):
+                    os.remove(destination)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                shutil.copy2(source, destination, follow_symlinks=False)
+        return diff
+
+    def _remove_local_file(self, path):
+        """
+        Removes a file from the local repository, and its parent folders if they become empty.
+        """
+        fullpath = os.path.join(self.local_dir, path)
+        if os.path.lexists(fullpath) and not os.path.isdir(fullpath):
+            os.remove(fullpath)
+        parent = os.path.dirname(fullpath)
+        while parent != self.local_dir.rstrip(os.sep) and os.path.isdir(parent):
+            if os.listdir(parent):
+                break
+            os.rmdir(parent)
+            parent = os.path.dirname(parent)
+
+    def check_remotes(self):
+        """
+        Fetch the remote repositories and check that they are in sync with the local repository.
+
+        Returns:
+            The git hash of the target repository.
+        """
+        log.info("    -> Checking that git repos are in sync")
+        self.fetch_remotes()
+        hash_init = self.check_sync_local_remote("target")
+        if self.backup_repo:
+            self.check_sync_local_remote("backup")
+            self.check_sync_remotes("target", "backup")
+        return hash_init
 
-    def deploy(self, message=None, files=None):
+    def deploy(self, message=None, files=None, diff=None, expected_hash=None):
         """
         Deploy the staged suite to the target repository.
         Steps:
             - git fetch remote repositories and check they are in sync
-            - rsync the staged folder to the local repository
-            - git add all the suite files and commit
-            - git push to remotes
+            - copy the changed files of the staged folder to the local repository
+              (skipped in direct mode, where files are added from the staged folder)
+            - git add the changed suite files and commit
+            - git push to the target, then to the backup, with the initial remote hash as lease
         Default commit message will be:
             "deployed by {user} from {host}:{staging_dir}"
 
         Parameters:
             message(str): optional git commit message to append to default message.
+            files(list): optional glob patterns of the files to deploy, by default everything is deployed.
+                Only the matching files are scanned, copied and committed.
+            diff(StagingDiff): optional changes computed by diff_staging, to avoid computing them again.
+                The deployment fails if the staged suite does not match them anymore.
+            expected_hash(str): optional git hash the target repository must be at.
         """
         log.info("Deploying suite to remote locations")
         # check if repos are in sync
-        log.info("    -> Checking that git repos are in sync")
-        hash_init = self.check_sync_local_remote("target")
-        if self.backup_repo:
-            self.check_sync_local_remote("backup")
-            self.check_sync_remotes("target", "backup")
+        hash_init = self.check_remotes()
+        if expected_hash is not None and hash_init != expected_hash:
+            raise RemoteMovedError("target", expected_hash, hash_init)
 
-        # rsync staging folder to current repo
-        log.info("    -> Staging suite")
+        expected_diff = diff
+        if diff is None:
+            diff = self.diff_staging(files)
 
-        rsync_options = "-avzc --delete  --exclude .git "
-        cmd = f"rsync {rsync_options} {self.staging_dir}/ {self.local_dir}/"
-        run_cmd(cmd)
+        if self.direct:
+            # the index is built straight from the staging folder
+            work_tree = self.staging_dir
+        else:
+            # copy the changed files of the staging folder to current repo
+            log.info("    -> Staging suite")
+            self.sync_staging(diff)
+            work_tree = None
 
         # git commit and push to remotes
         log.info("    -> Git commit")
-        if not self.commit(message, files):
+        paths = diff.new_paths() + diff.deleted_paths()
+        if not self.commit(message, paths, work_tree, expected_diff):
             log.info("Nothing to commit... aborting")
             return False
-        log.info(f"    -> Git push to target {self.target_repo} on host {self.host}")
 
-        hash_check = self.get_hash_remote("target")
-        if hash_check != hash_init:
+        # the remotes only accept the push if they are still at hash_init
+        self.push_to_remotes(expected=hash_init)
+
+        return True
+
+    def write_plan(self, plan_file, message=None, files=None, diff=None):
+        """
+        Write a deployment plan: the changes to deploy and the expected state of the target.
+        The plan can then be deployed with apply_plan, without computing the changes again.
+
+        Parameters:
+            plan_file(str): Path of the plan file (json).
+            message(str): optional git commit message to append to default message.
+            files(list): optional glob patterns of the files to deploy, by default everything is deployed.
+            diff(StagingDiff): optional changes computed by diff_staging.
+
+        Returns:
+            The plan as a dictionary.
+        """
+        hash_init = self.check_remotes()
+        if diff is None:
+            diff = self.diff_staging(files)
+        plan = {
+            "staging_dir": os.path.abspath(self.staging_dir),
+            "target": self.target_dir,
+            "host": self.host,
+            "user": self.user,
+            "target_repo": self.target_repo,
+            "expected_hash": hash_init,
+            "message": message,
+            "files": files,
+            "diff": diff.to_dict(),
+        }
+        with open(plan_file, "w") as f:
+            json.dump(plan, f, indent=2)
+        log.info(f"Deployment plan written to {plan_file}")
+        return plan
+
+    def apply_plan(self, plan):
+        """
+        Deploy exactly the changes of a plan written by write_plan.
+        Fails if the target repository or the staged files changed since the plan was written.
+
+        Parameters:
+            plan(dict): The plan, see read_plan.
+        """
+        if plan["target_repo"] != self.target_repo:
             raise Exception(
-                "Remote repositories have changed during deployment!\n \
-                Please check the state of the remote repositories"
+                f"Plan was computed for target {plan['target_repo']}, not {self.target_repo}"
             )
+        if plan["staging_dir"] != os.path.abspath(self.staging_dir):
+            raise Exception(
+                f"Plan was computed for staged suite {plan['staging_dir']}, not {self.staging_dir}"
+            )
+        return self.deploy(
+            plan["message"],
+            plan["files"],
+            diff=StagingDiff.from_dict(plan["diff"]),
+            expected_hash=plan["expected_hash"],
+        )
 
-        self.push("target")
-        if self.backup_repo:
-            log.info(f"    -> Git push to backup repository {self.backup_repo}")
-            self.push("backup")
 
-        return True
+def read_plan(plan_file):
+    """
+    Read a deployment plan written by GitDeployment.write_plan.
+    """
+    with open(plan_file, "r") as f:
+        return json.load(f)
 
 
 def get_parser():
     description = "Suite deployment tool"
     parser = argparse.ArgumentParser(description=description)
-    parser.add_argument("--stage", required=True, help="Staged suite")
+    parser.add_argument("--stage", help="Staged suite (required unless --apply)")
     parser.add_argument(
-        "--target", required=True, help="Path to target git repository on host"
+        "--target",
+        help="Path to target git repository on host (required unless --apply)",
     )
     parser.add_argument(
         "--local",
         help="Path to local git repository (will be created if doesn't exist)",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't reuse a cached clone of the target when --local is not given",
+    )
+    parser.add_argument(
+        "--direct",
+        action="store_true",
+        help="Commit directly from the staged suite, without copying it to the local repository",
+    )
+    parser.add_argument(
+        "--clone-mode",
+        default="full",
+        choices=CLONE_MODES,
+        help="How to clone the target repository (full, shallow or blobless)",
+    )
     parser.add_argument("--backup", help="URL to the backup git repository")
-    parser.add_argument("--host", default=os.getenv("HOSTNAME"), help="Target host")
-    parser.add_argument("--user", default=os.getenv("USER"), help="Deploy user")
+    # no defaults, to tell whether they are given when applying a plan
+    parser.add_argument("--host", help="Target host (default: $HOSTNAME)")
+    parser.add_argument("--user", help="Deploy user (default: $USER)")
     parser.add_argument("--message", help="Git message")
     parser.add_argument(
         "--push", action="store_true", help="Push staged suite to target"
@@ -196,49 +428,94 @@ def get_parser():
         "-f",
         "--files",
         nargs="+",
-        help="Specific files to deploy, by default everything is deployed",
+        help="Specific files or glob patterns to deploy, by default everything is deployed",
     )
+    parser.add_argument(
+        "--plan",
+        metavar="FILE",
+        help="Write the changes to deploy and the expected target state to a plan file",
+    )
+    parser.add_argument(
+        "--apply",
+        metavar="FILE",
+        help="Deploy exactly the changes of a plan file written with --plan",
+    )
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
     return parser
 
 
+@profiled
 def main(args=None):
     parser = get_parser()
     args = parser.parse_args()
 
-    log.info("Initialisation options:")
-    log.info(f"    - host: {args.host}")
-    log.info(f"    - user: {args.user}")
-    log.info(f"    - staged suite: {args.stage}")
-    log.info(f"    - local repo: {args.local}")
-    log.info(f"    - target repo: {args.target}")
-    log.info(f"    - backup repo: {args.backup}")
-    log.info(f"    - git message: {args.message}")
-    log.info(f"    - files to deploy: {args.files}")
-
-    deployer = GitDeployment(
-        host=args.host,
-        user=args.user,
-        staging_dir=args.stage,
-        local_repo=args.local,
-        target_repo=args.target,
-        backup_repo=args.backup,
-    )
-
-    deployer.pull_remotes()
-    deployer.diff_staging()
+    with record("deploy", args.metrics, log):
+        if args.apply:
+            plan = read_plan(args.apply)
+            args.stage = args.stage or plan["staging_dir"]
+            args.target = args.target or plan.get("target")
+            args.host = args.host or plan.get("host")
+            args.user = args.user or plan.get("user")
+            args.message = plan["message"]
+            args.files = plan["files"]
+        args.host = args.host or os.getenv("HOSTNAME")
+        args.user = args.user or os.getenv("USER")
+        if not args.stage or not args.target:
+            parser.error("--stage and --target are required")
 
-    if args.push:
-        if args.files is not None:
-            log.info("Deploying only the following files:")
-            for f in args.files:
-                log.info(f"    - {f}")
+        log.info("Initialisation options:")
+        log.info(f"    - host: {args.host}")
+        log.info(f"    - user: {args.user}")
+        log.info(f"    - staged suite: {args.stage}")
+        log.info(f"    - local repo: {args.local}")
+        log.info(f"    - target repo: {args.target}")
+        log.info(f"    - backup repo: {args.backup}")
+        log.info(f"    - git message: {args.message}")
+        log.info(f"    - files to deploy: {args.files}")
 
-        check = input(
-            "You are about to push the staged suite to the target directory. Are you sure? (y/N)"
+        deployer = GitDeployment(
+            host=args.host,
+            user=args.user,
+            staging_dir=args.stage,
+            local_repo=args.local,
+            target_repo=args.target,
+            backup_repo=args.backup,
+            use_cache=not args.no_cache,
+            clone_mode=args.clone_mode,
+            direct=args.direct,
         )
-        if check != "y":
-            exit(1)
-        deployer.deploy(args.message, args.files)
+
+        deployer.pull_remotes()
+
+        if args.apply:
+            # the changes come from the plan, they are not computed again
+            diff = StagingDiff.from_dict(plan["diff"])
+            diff.log()
+        else:
+            diff = deployer.diff_staging(args.files)
+
+        if args.plan:
+            deployer.write_plan(args.plan, args.message, args.files, diff)
+            return
+
+        if args.push or args.apply:
+            if args.files is not None:
+                log.info("Deploying only the following files:")
+                for f in args.files:
+                    log.info(f"    - {f}")
+
+            # the time waiting for the confirmation is not part of the timing
+            with excluded():
+                check = input(
+                    "You are about to push the staged suite to the target directory. Are you sure? (y/N)"
+                )
+            if check != "y":
+                exit(1)
+            if args.apply:
+                deployer.apply_plan(plan)
+            else:
+                deployer.deploy(args.message, args.files, diff=diff)
 
 
 if __name__ == "__main__":
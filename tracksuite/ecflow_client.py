@@ -1,8 +1,15 @@
 from __future__ import annotations  # ← annotations are strings at run‑time
 
-from typing import Any, cast
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from operator import methodcaller
+from typing import Any, List, Optional, cast
 
 from tracksuite import LOGGER as log
+from tracksuite.metrics import span
 
 try:
     import ecflow
@@ -10,6 +17,414 @@ except ModuleNotFoundError:
     ecflow = cast(Any, None)
 
 
+@dataclass
+class SyncResult:
+    """
+    Outcome of the synchronisation of a new node tree with an old one.
+    unmatched holds the paths of the new nodes that have no counterpart in the old tree
+    (they keep their new status), removed the paths of the old nodes absent from the new tree.
+    sent and skipped count the commands sent to the server and those skipped because
+    the new node was already up to date.
+    """
+
+    unmatched: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    sent: int = 0
+    skipped: int = 0
+
+    def count(self, sent, skipped):
+        self.sent += sent
+        self.skipped += skipped
+
+    def to_dict(self):
+        return asdict(self)
+
+    def log(self):
+        """
+        Logs a summary of the commands and of the unmatched nodes.
+        """
+        log.info(
+            f"Sent {self.sent} commands to the server, "
+            + f"skipped {self.skipped} already up to date"
+        )
+        _log_unmatched(self.unmatched, self.removed)
+
+
+def _log_unmatched(unmatched, removed):
+    for name, paths in [
+        ("New nodes not found in the old suite", unmatched),
+        ("Old nodes not found in the new suite", removed),
+    ]:
+        if paths:
+            log.warning(f"{name} ({len(paths)}): {', '.join(paths[:10])}")
+            if len(paths) > 10:
+                log.warning(f"    ... and {len(paths) - 10} more")
+
+
+@dataclass
+class SyncOperation:
+    """
+    A change to apply to a node of the new tree, to restore the value it had in the old tree.
+    command is one of state, dstate, defstatus, attribute or repeat. For attributes,
+    attribute is the kind of attribute (see ATTRIBUTE_KINDS) and name its name.
+    """
+
+    command: str
+    path: str
+    value: Any
+    attribute: Optional[str] = None
+    name: Any = None
+
+
+# order in which the operations of a plan are applied, phase -> commands.
+# A node is forced to its state before it is resumed, or the server may submit it
+SYNC_PHASES = {
+    "state": ["state"],
+    "dstate": ["dstate"],
+    "defstatus": ["defstatus"],
+    "attributes": ["attribute"],
+    "repeat": ["repeat"],
+}
+
+
+@dataclass
+class SyncPlan:
+    """
+    Changes computed by plan_sync to synchronise a new node tree with an old one,
+    applied by EcflowClient.execute_plan. skipped counts the values already up to date,
+    unmatched and removed are the same as in SyncResult.
+    """
+
+    operations: List[SyncOperation] = field(default_factory=list)
+    unmatched: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    skipped: int = 0
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, content):
+        content = dict(content)
+        content["operations"] = [
+            SyncOperation(**operation) for operation in content.get("operations", [])
+        ]
+        return cls(**content)
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def read(cls, path):
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+    def counts(self):
+        """
+        Returns the number of operations of each command (of each attribute kind for attributes).
+        """
+        counts = {}
+        for operation in self.operations:
+            key = operation.attribute or operation.command
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def log(self, unmatched=True):
+        """
+        Logs a summary of the operations and, unless unmatched is False, of the unmatched nodes.
+        """
+        log.info(
+            f"Sync plan: {len(self.operations)} changes, "
+            + f"{self.skipped} values already up to date"
+        )
+        for key, count in self.counts().items():
+            log.info(f"    - {key}: {count}")
+        if unmatched:
+            _log_unmatched(self.unmatched, self.removed)
+
+
+# attribute kinds synchronised by EcflowClient.update_node_attributes:
+# node property -> (name of an attribute, value of an attribute, EcflowClient setter)
+ATTRIBUTE_KINDS = {
+    "events": (methodcaller("name_or_number"), methodcaller("value"), "set_event"),
+    "meters": (methodcaller("name"), methodcaller("value"), "set_meter"),
+    "labels": (methodcaller("name"), methodcaller("value"), "set_label"),
+    "variables": (methodcaller("name"), methodcaller("value"), "set_variable"),
+    "limits": (methodcaller("name"), methodcaller("value"), "set_limit"),
+    "inlimits": (
+        lambda inlimit: (inlimit.path_to_node(), inlimit.name()),
+        methodcaller("tokens"),
+        "set_inlimit",
+    ),
+}
+
+
+def diff_node_status(new_node: ecflow.Node, old_node: ecflow.Node):
+    """
+    Compares the status of two nodes:
+        - state: queued, running, complete, failed
+        - dstate: suspended or state
+        - defstatus: complete or queued
+
+    Returns:
+        The operations restoring the old status on the new node, and the number of values
+        already up to date.
+    """
+    node_path = new_node.get_abs_node_path()
+    operations = []
+
+    # a node of a definition loaded locally has no state yet,
+    # it gets its defstatus when it is replaced on the server
+    new_state = str(new_node.get_state())
+    old_state = str(old_node.get_state())
+    if new_state == "unknown" and old_state != "unknown":
+        new_state = str(new_node.get_defstatus())
+    if new_state != old_state:
+        operations.append(SyncOperation("state", node_path, old_state))
+
+    # any other dstate follows the state
+    old_dstate = str(old_node.get_dstate())
+    if (str(new_node.get_dstate()) == "suspended") != (old_dstate == "suspended"):
+        operations.append(SyncOperation("dstate", node_path, old_dstate))
+
+    old_defstatus = str(old_node.get_defstatus())
+    if str(new_node.get_defstatus()) != old_defstatus:
+        operations.append(SyncOperation("defstatus", node_path, old_defstatus))
+
+    return operations, 3 - len(operations)
+
+
+def diff_node_attributes(
+    new_node: ecflow.Node, old_node: ecflow.Node, attributes: list
+):
+    """
+    Compares the attributes of each kind (see ATTRIBUTE_KINDS, e.g. events, meters, labels, variables)
+    of two nodes, matched by name. Attributes missing from one of the nodes are ignored.
+
+    Returns:
+        The operations restoring the old values on the new node, and the number of values
+        already up to date.
+    """
+    node_path = new_node.get_abs_node_path()
+    operations = []
+    skipped = 0
+    for attr in attributes:
+        kind = attr if attr in ATTRIBUTE_KINDS else f"{attr}s"
+        if kind not in ATTRIBUTE_KINDS:
+            raise ValueError(
+                f"Unknown attribute {attr}, choose from {list(ATTRIBUTE_KINDS)}"
+            )
+        get_key, get_value, _ = ATTRIBUTE_KINDS[kind]
+        new_values = {
+            get_key(new_attr): get_value(new_attr)
+            for new_attr in getattr(new_node, kind)
+        }
+        for old_attr in getattr(old_node, kind):
+            old_name = get_key(old_attr)
+            if old_name not in new_values:
+                continue
+            old_value = get_value(old_attr)
+            if new_values[old_name] != old_value:
+                operations.append(
+                    SyncOperation("attribute", node_path, old_value, kind, old_name)
+                )
+            else:
+                skipped += 1
+    return operations, skipped
+
+
+def diff_node_repeat(new_node: ecflow.Node, old_node: ecflow.Node):
+    """
+    Compares the value of the repeat attribute of two nodes.
+
+    Returns:
+        The operations restoring the old value on the new node, and the number of values
+        already up to date.
+    """
+    repeat = old_node.get_repeat()
+    if str(repeat) == "":  # maybe better way to check this?
+        return [], 0
+    new_repeat = new_node.get_repeat()
+    if str(new_repeat) != "" and str(new_repeat.value()) == str(repeat.value()):
+        return [], 1
+    operations = [
+        SyncOperation("repeat", new_node.get_abs_node_path(), str(repeat.value()))
+    ]
+    return operations, 0
+
+
+def plan_sync(
+    new_node: ecflow.Node,
+    old_node: ecflow.Node,
+    attributes: list = ["events", "meters", "labels"],
+    skip_status: bool = False,
+    skip_attributes: bool = False,
+    skip_repeat: bool = False,
+    plan: SyncPlan = None,
+) -> SyncPlan:
+    """
+    Recursively compares the new node tree with the old one, the children being matched by name,
+    without changing anything on the server.
+
+    Returns:
+        SyncPlan: the operations restoring the status, attributes and repeats of the old tree
+        on the new one, and the nodes that could not be matched between the two trees.
+    """
+    if plan is None:
+        plan = SyncPlan()
+
+    node_path = new_node.get_abs_node_path()
+    if old_node.get_abs_node_path() != node_path:
+        plan.unmatched.append(node_path)
+        return plan
+
+    diffs = []
+    if not skip_status:
+        diffs.append(diff_node_status(new_node, old_node))
+    if not skip_attributes:
+        diffs.append(diff_node_attributes(new_node, old_node, attributes))
+    if not skip_repeat:
+        diffs.append(diff_node_repeat(new_node, old_node))
+    for operations, skipped in diffs:
+        plan.operations.extend(operations)
+        plan.skipped += skipped
+
+    # Recurse through children, indexing the old children by name once per level
+    old_children = {old_child.name(): old_child for old_child in old_node.nodes}
+    for new_child in new_node.nodes:
+        old_child = old_children.pop(new_child.name(), None)
+        if old_child is None:
+            plan.unmatched.append(new_child.get_abs_node_path())
+            continue
+        plan_sync(
+            new_child,
+            old_child,
+            attributes,
+            skip_status,
+            skip_attributes,
+            skip_repeat,
+            plan,
+        )
+    plan.removed.extend(
+        old_child.get_abs_node_path() for old_child in old_children.values()
+    )
+    return plan
+
+
+class _TimedClient:
+    """
+    Forwards the calls to an ecflow.Client, timing each of them as an "ecflow:<method>" span.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with span(f"ecflow:{name}"):
+                return attr(*args, **kwargs)
+
+        return call
+
+
+# maximum number of node paths sent in a single request by CommandBatch
+BATCH_SIZE = 1000
+
+# order in which CommandBatch sends the client methods: a node must be forced to its state
+# before it is resumed, or the server may submit it while it is still queued
+BATCH_ORDER = ["force_state", "suspend", "resume", "alter"]
+
+
+def _batch_rank(method):
+    return BATCH_ORDER.index(method) if method in BATCH_ORDER else len(BATCH_ORDER)
+
+
+class CommandBatch:
+    """
+    Commands collected during a sync, grouped by client method and arguments,
+    e.g. all the force_state(path, complete) calls, so that each group is sent as
+    few multi-path requests as possible. The groups are sent method by method (see BATCH_ORDER),
+    and in the order they first appeared for the same method. With several workers,
+    the requests of a method are sent concurrently, each worker with its own client
+    created by connect.
+    """
+
+    def __init__(self, client, size: int = BATCH_SIZE, workers: int = 1, connect=None):
+        self.client = client
+        self.size = size
+        self.workers = workers
+        self.connect = connect
+        # (method, args) -> node paths
+        self.commands = {}
+
+    def __len__(self):
+        return sum(len(paths) for paths in self.commands.values())
+
+    def add(self, method: str, node_path: str, *args):
+        """
+        Add a call to client.<method>(node_path, *args) to the batch.
+        """
+        self.commands.setdefault((method, args), []).append(node_path)
+
+    def flush(self):
+        """
+        Send all the commands of the batch to the server.
+
+        Returns:
+            The number of requests sent.
+        """
+        commands, self.commands = self.commands, {}
+        # requests of each method, in BATCH_ORDER (sorted is stable)
+        tiers = {}
+        for (method, args), paths in sorted(
+            commands.items(), key=lambda item: _batch_rank(item[0][0])
+        ):
+            tiers.setdefault(method, []).extend(
+                (method, paths[start : start + self.size], args)
+                for start in range(0, len(paths), self.size)
+            )
+        requests = [request for tier in tiers.values() for request in tier]
+        total = sum(len(paths) for paths in commands.values())
+        progress = {"sent": 0, "step": 0}
+        lock = threading.Lock()
+
+        def send(client, request):
+            method, paths, args = request
+            getattr(client, method)(paths, *args)
+            with lock:
+                progress["sent"] += len(paths)
+                # log about every 10% of the commands
+                step = progress["sent"] * 10 // total
+                if step > progress["step"] and progress["sent"] < total:
+                    progress["step"] = step
+                    log.info(f"    -> {progress['sent']}/{total} commands sent")
+
+        if self.workers > 1 and self.connect is not None and len(requests) > 1:
+            local = threading.local()
+
+            def send_concurrently(request):
+                if not hasattr(local, "client"):
+                    local.client = self.connect()
+                send(local.client, request)
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                # a method is only sent once all the requests of the previous one are done
+                for tier in tiers.values():
+                    list(executor.map(send_concurrently, tier))
+        else:
+            for request in requests:
+                send(self.client, request)
+
+        if commands:
+            log.info(f"Sent {total} commands in {len(requests)} requests")
+        return len(requests)
+
+
 class EcflowClient:
     """
     Class to handle the connection to the ecflow server.
@@ -26,14 +441,55 @@ class EcflowClient:
 
         self.host = host
         self.port = port
+        self.ssl = ssl
+        self._batch = None
+        # number of commands sent to the server (or added to a batch)
+        self.commands_sent = 0
+        self.client = self._connect()
 
-        if host is None and port is None:
-            self.client = ecflow.Client()
+    def _connect(self):
+        """
+        Returns a new client to the ecflow server.
+        """
+        if self.host is None and self.port is None:
+            client = _TimedClient(ecflow.Client())
         else:
-            self.client = ecflow.Client(host, port)
+            client = _TimedClient(ecflow.Client(self.host, self.port))
+
+        if self.ssl:
+            client.enable_ssl()
+        return client
 
-        if ssl:
-            self.client.enable_ssl()
+    @contextmanager
+    def batched(self, size: int = BATCH_SIZE, workers: int = 1):
+        """
+        Collect the commands of the set_* methods and send them grouped
+        at the end of the block, see CommandBatch. With several workers,
+        the requests are sent concurrently over one connection per worker.
+
+        Usage:
+            with client.batched():
+                client.sync_node_recursive(new_suite, old_suite)
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+        self._batch = CommandBatch(self.client, size, workers, self._connect)
+        try:
+            yield self._batch
+            self._batch.flush()
+        finally:
+            self._batch = None
+
+    def _send(self, method: str, node_path: str, *args):
+        """
+        Call client.<method>(node_path, *args), or add it to the current batch.
+        """
+        self.commands_sent += 1
+        if self._batch is not None:
+            self._batch.add(method, node_path, *args)
+        else:
+            getattr(self.client, method)(node_path, *args)
 
     def update(self):
         """
@@ -69,42 +525,40 @@ class EcflowClient:
         """
         Set the state of the node on the server.
         """
-        self.client.force_state(node_path, state)
+        self._send("force_state", node_path, state)
 
     def set_dstate(self, node_path: str, dstate: ecflow.DState):
         """
         Set the dstate of the node on the server.
         """
         if str(dstate) == "suspended":
-            self.client.suspend(node_path)
+            self._send("suspend", node_path)
         else:
-            self.client.resume(node_path)
+            self._send("resume", node_path)
 
     def set_defstatus(self, node_path: str, defstatus: ecflow.DState):
         """
         Set the defstatus of the node on the server.
         """
-        self.client.alter(node_path, "change", "defstatus", str(defstatus))
+        self._send("alter", node_path, "change", "defstatus", str(defstatus))
 
     def update_node_status(self, new_node: ecflow.Node, old_node: ecflow.Node):
         """
         Update the status of a node based on the old node's status.
-        This function updates the following attributes on the server:
-            - state: queued, running, complete, failed
-            - dstate: suspended or state
-            - defstatus: complete or queued
+        Only the state, dstate and defstatus that differ are updated on the server,
+        see diff_node_status.
+
+        Returns:
+            The number of commands sent and skipped.
         """
-        node_path = new_node.get_abs_node_path()
-        # Update state-related status
-        self.set_state(node_path, old_node.get_state())
-        self.set_dstate(node_path, old_node.get_dstate())
-        self.set_defstatus(node_path, old_node.get_defstatus())
+        operations, skipped = diff_node_status(new_node, old_node)
+        return self._apply_operations(operations), skipped
 
     def set_variable(self, node_path: str, key: str, value: str):
         """
         Set a variable on the server.
         """
-        self.client.alter(node_path, "change", "variable", key, value)
+        self._send("alter", node_path, "change", "variable", key, value)
 
     def set_event(self, node_path: str, key: str, value: bool):
         """
@@ -118,19 +572,35 @@ class EcflowClient:
             raise ValueError(
                 f"Event value must {key} be 'set' or 'clear', value is {value}"
             )
-        self.client.alter(node_path, "change", "event", key, value)
+        self._send("alter", node_path, "change", "event", key, value)
 
     def set_meter(self, node_path: str, key: str, value: str):
         """
         Set a meter on the server.
         """
-        self.client.alter(node_path, "change", "meter", key, value)
+        self._send("alter", node_path, "change", "meter", key, str(value))
 
     def set_label(self, node_path: str, key: str, value: str):
         """
         Set a label on the server.
         """
-        self.client.alter(node_path, "change", "label", key, value)
+        self._send("alter", node_path, "change", "label", key, value)
+
+    def set_limit(self, node_path: str, key: str, value: int):
+        """
+        Set the value (consumed tokens) of a limit on the server.
+        """
+        self._send("alter", node_path, "change", "limit_value", key, str(value))
+
+    def set_inlimit(self, node_path: str, key: tuple, value: int):
+        """
+        Inlimits can not be changed on the server, the new definition is kept.
+        """
+        path, name = key
+        log.warning(
+            f"inlimit {path}:{name} of {node_path} has changed ({value} tokens before), "
+            + "keeping the new definition"
+        )
 
     def update_node_attributes(
         self,
@@ -140,85 +610,125 @@ class EcflowClient:
     ):
         """
         Update the attributes of a node based on the old node's attributes.
-        This function updates the following attributes on the server:
-            - state
-            - dstate
-            - defstatus
-        """
-        node_path = new_node.get_abs_node_path()
-        for attr in attributes:
-            old_attributes = getattr(old_node, attr)  # need to use plural form)
-            for old_attr in old_attributes:
-                # special case for event, where name_or_number is required instead of name
-                old_name = getattr(
-                    old_attr, "name_or_number", getattr(old_attr, "name")
-                )()
-                old_value = getattr(old_attr, "value")()
-                new_attributes = getattr(new_node, attr)  # need to use plural form)
-                for new_attr in new_attributes:
-                    new_name = getattr(
-                        new_attr, "name_or_number", getattr(new_attr, "name")
-                    )()
-                    new_value = getattr(new_attr, "value")()
-                    if new_name == old_name:
-                        if new_value != old_value:
-                            getattr(self, "set_" + attr)(node_path, old_name, old_value)
+        The attributes of each kind (see ATTRIBUTE_KINDS, e.g. events, meters, labels, variables)
+        are matched by name, and only the attributes whose value differs are updated on the server.
+
+        Returns:
+            The number of commands sent and skipped.
+        """
+        operations, skipped = diff_node_attributes(new_node, old_node, attributes)
+        return self._apply_operations(operations), skipped
 
     def update_node_repeat(self, new_node: ecflow.Node, old_node: ecflow.Node):
         """
         Update the repeat attribute of a node based on the old node's repeat attribute.
-        This function updates the repeat attribute on the server.
+        This function updates the repeat attribute on the server, if its value differs.
+
+        Returns:
+            The number of commands sent and skipped.
+        """
+        operations, skipped = diff_node_repeat(new_node, old_node)
+        return self._apply_operations(operations), skipped
+
+    def _apply_operations(self, operations):
+        """
+        Apply operations, returning the number of commands sent
+        (inlimits are never sent, see set_inlimit).
         """
-        node_path = new_node.get_abs_node_path()
+        sent = self.commands_sent
+        for operation in operations:
+            self.apply_operation(operation)
+        return self.commands_sent - sent
 
-        repeat = old_node.get_repeat()
-        if str(repeat) != "":  # maybe better way to check this?
-            self.client.alter(node_path, "change", "repeat", str(repeat.value()))
+    def apply_operation(self, operation: SyncOperation):
+        """
+        Apply an operation of a SyncPlan on the server (or add it to the current batch).
+        """
+        command = operation.command
+        if command == "state":
+            self.set_state(operation.path, getattr(ecflow.State, operation.value))
+        elif command == "dstate":
+            self.set_dstate(operation.path, operation.value)
+        elif command == "defstatus":
+            self.set_defstatus(operation.path, operation.value)
+        elif command == "attribute":
+            setter = ATTRIBUTE_KINDS[operation.attribute][2]
+            getattr(self, setter)(operation.path, operation.name, operation.value)
+        elif command == "repeat":
+            self._send("alter", operation.path, "change", "repeat", operation.value)
+        else:
+            raise ValueError(f"Unknown sync operation {command}")
+
+    def execute_plan(
+        self, plan: SyncPlan, size: int = BATCH_SIZE, workers: int = 1
+    ) -> SyncResult:
+        """
+        Apply a SyncPlan on the server, one phase after the other (see SYNC_PHASES).
+        The operations of each phase are sent in batches, see CommandBatch,
+        and with several workers only the requests of the same phase are sent concurrently.
+
+        Parameters:
+            plan(SyncPlan): The operations to apply.
+            size(int): Maximum number of node paths in a request.
+            workers(int): Number of requests sent concurrently.
+
+        Returns:
+            SyncResult: the number of commands sent and the unmatched nodes of the plan.
+        """
+        phases = {
+            command: phase
+            for phase, commands in SYNC_PHASES.items()
+            for command in commands
+        }
+        operations = {phase: [] for phase in SYNC_PHASES}
+        for operation in plan.operations:
+            if operation.command not in phases:
+                raise ValueError(f"Unknown sync operation {operation.command}")
+            operations[phases[operation.command]].append(operation)
+
+        sent = 0
+        for phase, phase_operations in operations.items():
+            if not phase_operations:
+                continue
+            log.info(f"Applying {len(phase_operations)} {phase} changes")
+            with span(f"sync:{phase}"), self.batched(size, workers):
+                sent += self._apply_operations(phase_operations)
+
+        return SyncResult(
+            unmatched=list(plan.unmatched),
+            removed=list(plan.removed),
+            sent=sent,
+            skipped=plan.skipped,
+        )
 
     def sync_node_recursive(
         self,
         new_node: ecflow.Node,
         old_node: ecflow.Node,
-        attributes: list = ["event", "meter", "label"],
+        attributes: list = ["events", "meters", "labels"],
         skip_status: bool = False,
         skip_attributes: bool = False,
         skip_repeat: bool = False,
-    ):
+        result: SyncResult = None,
+    ) -> SyncResult:
         """
         Recursively sync the status of nodes in the new suite with the old suite.
-        This function updates the status of the new node based on the old node's status.
-        It also recurses through the children of the new node.
-        """
-        # Compute full path of current new_node
-        node_path = new_node.get_abs_node_path()
-        if old_node.get_abs_node_path() != node_path:
-            log.warning(f"could not find node {node_path}")
-            return False
-
-        if not skip_status:
-            self.update_node_status(new_node, old_node)
-        if not skip_attributes:
-            self.update_node_attributes(new_node, old_node, attributes)
-        if not skip_repeat:
-            self.update_node_repeat(new_node, old_node)
-
-        # Recurse through children
-        for new_child in new_node.nodes:
-            for old_child in old_node.nodes:
-                if new_child.name() == old_child.name():
-                    self.sync_node_recursive(
-                        new_child,
-                        old_child,
-                        attributes,
-                        skip_status,
-                        skip_attributes,
-                        skip_repeat,
-                    )
-                    break
-            else:
-                log.warning(
-                    f"Could not find child node {new_child.name()} in old node {node_path}"
-                )
+        The changes are first computed with plan_sync, then applied with execute_plan.
+
+        Returns:
+            SyncResult: the nodes that could not be matched between the two trees,
+            and the number of commands sent and skipped.
+        """
+        plan = plan_sync(
+            new_node, old_node, attributes, skip_status, skip_attributes, skip_repeat
+        )
+        plan_result = self.execute_plan(plan)
+        if result is None:
+            return plan_result
+        result.unmatched.extend(plan_result.unmatched)
+        result.removed.extend(plan_result.removed)
+        result.count(plan_result.sent, plan_result.skipped)
+        return result
 
     def replace_on_server(
         self,
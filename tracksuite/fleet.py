@@ -0,0 +1,292 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from tracksuite import LOGGER as log
+from tracksuite.cache import get_cache_dir
+from tracksuite.deploy import GitDeployment
+from tracksuite.init import setup_remote
+from tracksuite.profiling import add_profile_arguments, profiled
+from tracksuite.repos import CLONE_MODES
+from tracksuite.staging import StagingManifest
+
+DEFAULT_WORKERS = 8
+
+
+def read_inventory(inventory_file):
+    """
+    Reads an inventory file: a JSON list of targets, each with a "target" path and
+    optional "host", "user", "backup" and "name" entries.
+
+    Returns:
+        List of dictionaries with the host, user, target, backup and name of each target.
+    """
+    with open(inventory_file, "r") as f:
+        content = json.load(f)
+    if isinstance(content, dict):
+        content = content.get("targets", [])
+
+    entries = []
+    for i, item in enumerate(content):
+        if "target" not in item:
+            raise ValueError(f"Entry {i} of inventory {inventory_file} has no target")
+        entry = {
+            "host": item.get("host", "localhost"),
+            "user": item.get("user", os.getenv("USER")),
+            "target": item["target"],
+            "backup": item.get("backup"),
+        }
+        entry["name"] = item.get(
+            "name", f"{entry['user']}@{entry['host']}:{entry['target']}"
+        )
+        entries.append(entry)
+    return entries
+
+
+def run_fleet(func, entries, workers=DEFAULT_WORKERS):
+    """
+    Runs an operation on all the targets of an inventory concurrently.
+    A failure on one target does not stop the others.
+
+    Parameters:
+        func(callable): Operation taking an inventory entry, its return value is the result.
+        entries(list): Inventory entries, see read_inventory.
+        workers(int): Maximum number of targets processed at the same time.
+
+    Returns:
+        List of dictionaries with the name, status ("ok" or "failed") and
+        result or error of each target, in the inventory order.
+    """
+
+    def run(entry):
+        try:
+            return {"name": entry["name"], "status": "ok", "result": func(entry)}
+        except Exception as exc:
+            log.error(f"{entry['name']}: {exc}")
+            return {"name": entry["name"], "status": "failed", "error": str(exc)}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, entries))
+
+
+def init_entry(entry, force=False):
+    """
+    Initialises the target repository of an inventory entry.
+
+    Returns:
+        The hash of the first commit.
+    """
+    return setup_remote(
+        entry["host"], entry["user"], entry["target"], entry["backup"], force
+    )
+
+
+def scan_staging(staging_dir, files=None):
+    """
+    Scans the staged suite once for all the targets. The manifest is kept in the
+    cache directory, so that the next runs only hash the files that changed.
+
+    Parameters:
+        staging_dir(str): The staged suite.
+        files(list): optional glob patterns, only the matching files are scanned.
+
+    Returns:
+        Dictionary of path -> (git mode, git blob hash, size), see StagingManifest.scan.
+    """
+    cache_dir = get_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    digest = hashlib.sha1(os.path.abspath(staging_dir).encode()).hexdigest()
+    manifest = StagingManifest(
+        staging_dir, os.path.join(cache_dir, f"staging-{digest[:16]}.json")
+    )
+    staged = manifest.scan(files)
+    manifest.save()
+    return staged
+
+
+def deploy_entry(
+    entry,
+    staging_dir,
+    message=None,
+    files=None,
+    push=False,
+    use_cache=True,
+    clone_mode="full",
+    direct=False,
+    staged=None,
+):
+    """
+    Deploys a staged suite to the target repository of an inventory entry.
+    The staged files scanned by scan_staging can be given, to only compare them
+    with the index of the target instead of scanning the staged suite again.
+
+    Returns:
+        A summary of the changes, and whether they were deployed.
+    """
+    deployer = GitDeployment(
+        host=entry["host"],
+        user=entry["user"],
+        staging_dir=staging_dir,
+        target_repo=entry["target"],
+        backup_repo=entry["backup"],
+        use_cache=use_cache,
+        clone_mode=clone_mode,
+        direct=direct,
+    )
+    try:
+        deployer.pull_remotes()
+        diff = deployer.diff_staging(files, staged=staged)
+        summary = (
+            f"{len(diff.added)} added, {len(diff.modified)} modified, "
+            + f"{len(diff.removed)} removed, {len(diff.renamed)} renamed"
+        )
+        if not push:
+            return summary
+        if not deployer.deploy(message, files, diff=diff):
+            return "nothing to deploy"
+        return f"deployed {deployer.repo.head.commit.hexsha} ({summary})"
+    finally:
+        deployer.close()
+
+
+def report(results, as_json=False):
+    """
+    Prints the result of each target and a summary.
+
+    Returns:
+        The exit code: 0 if all the targets succeeded, 1 otherwise.
+    """
+    failed = [result for result in results if result["status"] != "ok"]
+    if as_json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            detail = (
+                result.get("result") if result["status"] == "ok" else result["error"]
+            )
+            print(f"[{result['status']}] {result['name']}: {detail}")
+        print(f"{len(results) - len(failed)} succeeded, {len(failed)} failed")
+    return 1 if failed else 0
+
+
+def get_parser():
+    description = "Initialise or deploy suites on many targets at once"
+    parser = argparse.ArgumentParser(description=description)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(subparser):
+        subparser.add_argument(
+            "inventory",
+            help="JSON file listing the targets (target, host, user, backup)",
+        )
+        subparser.add_argument(
+            "--workers",
+            type=int,
+            default=DEFAULT_WORKERS,
+            help="Maximum number of targets processed at the same time",
+        )
+        subparser.add_argument(
+            "--json", action="store_true", help="Output the results in JSON format"
+        )
+        subparser.add_argument(
+            "--no_prompt",
+            action="store_true",
+            help="No prompt, will go through without user input",
+        )
+        add_profile_arguments(subparser)
+
+    init_parser = subparsers.add_parser(
+        "init", help="Initialise the target repositories"
+    )
+    add_common(init_parser)
+    init_parser.add_argument(
+        "--force", action="store_true", help="Force push to backups"
+    )
+
+    deploy_parser = subparsers.add_parser(
+        "deploy", help="Deploy a staged suite to the targets"
+    )
+    add_common(deploy_parser)
+    deploy_parser.add_argument("--stage", required=True, help="Staged suite")
+    deploy_parser.add_argument("--message", help="Git message")
+    deploy_parser.add_argument(
+        "--push", action="store_true", help="Push staged suite to the targets"
+    )
+    deploy_parser.add_argument(
+        "-f",
+        "--files",
+        nargs="+",
+        help="Specific files or glob patterns to deploy, by default everything is deployed",
+    )
+    deploy_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't reuse cached clones of the targets",
+    )
+    deploy_parser.add_argument(
+        "--direct",
+        action="store_true",
+        help="Commit directly from the staged suite, without copying it to the local repositories",
+    )
+    deploy_parser.add_argument(
+        "--clone-mode",
+        default="full",
+        choices=CLONE_MODES,
+        help="How to clone the target repositories (full, shallow or blobless)",
+    )
+    return parser
+
+
+@profiled
+def main(args=None):
+    parser = get_parser()
+    args = parser.parse_args()
+
+    entries = read_inventory(args.inventory)
+    log.info(f"Fleet {args.command} on {len(entries)} targets:")
+    for entry in entries:
+        log.info(f"    - {entry['name']}")
+
+    if args.command == "init":
+        if args.force and not args.no_prompt:
+            check = input(
+                "You are about to force push to the backup repositories. Are you sure? (Y/n)"
+            )
+            if check != "Y":
+                exit(1)
+
+        def func(entry):
+            return init_entry(entry, args.force)
+
+    else:
+        if args.push and not args.no_prompt:
+            check = input(
+                f"You are about to push the staged suite to {len(entries)} targets. Are you sure? (y/N)"
+            )
+            if check != "y":
+                exit(1)
+
+        staged = scan_staging(args.stage, args.files)
+
+        def func(entry):
+            return deploy_entry(
+                entry,
+                args.stage,
+                message=args.message,
+                files=args.files,
+                push=args.push,
+                use_cache=not args.no_cache,
+                clone_mode=args.clone_mode,
+                direct=args.direct,
+                staged=staged,
+            )
+
+    results = run_fleet(func, entries, args.workers)
+    sys.exit(report(results, args.json))
+
+
+if __name__ == "__main__":
+    main()
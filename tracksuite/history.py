@@ -0,0 +1,354 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+import git
+
+from tracksuite import LOGGER as log
+from tracksuite.cache import get_cache_dir, get_cache_key
+from tracksuite.profiling import add_profile_arguments, profiled
+from tracksuite.repos import GitRepositories
+from tracksuite.staging import match_path, static_prefix
+
+# first line of the commit messages written by GitDeployment.commit
+DEPLOY_MESSAGE = re.compile(
+    r"^deployed by (?P<user>\S+) from (?P<host>[^:\s]*):(?P<staging_dir>.*)$"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS commits (
+    hexsha TEXT PRIMARY KEY,
+    time INTEGER NOT NULL,
+    author TEXT,
+    deploy_user TEXT,
+    deploy_host TEXT,
+    staging_dir TEXT,
+    message TEXT
+);
+CREATE TABLE IF NOT EXISTS files (hexsha TEXT NOT NULL, path TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE INDEX IF NOT EXISTS commits_time ON commits (time);
+CREATE INDEX IF NOT EXISTS commits_user ON commits (deploy_user);
+CREATE INDEX IF NOT EXISTS commits_host ON commits (deploy_host);
+CREATE INDEX IF NOT EXISTS commits_staging_dir ON commits (staging_dir);
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+CREATE INDEX IF NOT EXISTS files_hexsha ON files (hexsha);
+"""
+
+COLUMNS = [
+    "hexsha",
+    "time",
+    "author",
+    "deploy_user",
+    "deploy_host",
+    "staging_dir",
+    "message",
+]
+
+
+def get_index_path(user, host, target_repo):
+    """
+    Returns the default path of the history index of a target repository,
+    next to the cached clones.
+    """
+    key = get_cache_key(user, host, target_repo)
+    return os.path.join(get_cache_dir(), ".history", f"{key}.sqlite")
+
+
+def parse_commits(output):
+    """
+    Parses the output of git log written with DeploymentHistory.LOG_FORMAT and --name-only.
+
+    Returns:
+        List of (commit row, list of paths), newest commit first.
+    """
+    commits = []
+    for record in output.split("\0")[1:]:
+        header, _, names = record.partition("\x1e")
+        hexsha, time, author, body = header.split("\x1f", 3)
+        first_line, _, message = body.strip().partition("\n")
+        match = DEPLOY_MESSAGE.match(first_line)
+        if match:
+            deploy = (match["user"], match["host"], match["staging_dir"])
+            message = message.strip()
+        else:
+            deploy = (None, None, None)
+            message = body.strip()
+        paths = [name for name in names.split("\n") if name]
+        commits.append(((hexsha, int(time), author) + deploy + (message,), paths))
+    return commits
+
+
+class DeploymentHistory:
+    LOG_FORMAT = "%x00%H%x1f%at%x1f%an%x1f%B%x1e"
+
+    def __init__(self, repo, index_path):
+        """
+        Local index of the commits of a target repository, answering queries on
+        who deployed what, when and from where without walking the git history.
+        The index is updated incrementally with the commits added since the last update.
+
+        Parameters:
+            repo(git.Repo): Local clone of the target repository.
+            index_path(str): Path of the sqlite index.
+        """
+        self.repo = repo
+        self.index_path = index_path
+        index_dir = os.path.dirname(index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        self.db = sqlite3.connect(index_path)
+        self.db.create_function("match_path", 2, match_path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def get_tip(self):
+        """
+        Returns the last indexed commit, or None if the index is empty.
+        """
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'tip'").fetchone()
+        return row[0] if row else None
+
+    def _is_ancestor(self, tip, new_tip):
+        """
+        Returns True if the indexed tip is an ancestor of new_tip.
+        A tip missing from the clone (e.g. a fresh clone of a rewritten history) is not.
+        """
+        try:
+            self.repo.git.rev_parse("--verify", "--quiet", f"{tip}^{{commit}}")
+        except git.exc.GitCommandError:
+            return False
+        return self.repo.is_ancestor(tip, new_tip)
+
+    def update(self, rev="HEAD"):
+        """
+        Index the commits added since the last update.
+        The index is rebuilt from scratch if the history has been rewritten.
+
+        Parameters:
+            rev(str): The revision to index the history of.
+
+        Returns:
+            Number of commits indexed.
+        """
+        tip = self.get_tip()
+        new_tip = self.repo.commit(rev).hexsha
+        if tip == new_tip:
+            return 0
+
+        log_range = new_tip
+        if tip is not None and self._is_ancestor(tip, new_tip):
+            log_range = f"{tip}..{new_tip}"
+        elif tip is not None:
+            log.info("    -> History has been rewritten, rebuilding the index")
+            tip = None
+
+        output = self.repo.git(c="core.quotePath=false").log(
+            log_range,
+            format=self.LOG_FORMAT,
+            name_only=True,
+            no_renames=True,
+        )
+        commits = parse_commits(output)
+
+        with self.db:
+            if tip is None:
+                self.db.execute("DELETE FROM commits")
+                self.db.execute("DELETE FROM files")
+            # oldest first, so that the row order follows the history
+            for row, paths in reversed(commits):
+                self.db.execute(
+                    f"INSERT OR REPLACE INTO commits VALUES ({', '.join('?' * len(COLUMNS))})",
+                    row,
+                )
+                self.db.executemany(
+                    "INSERT INTO files VALUES (?, ?)",
+                    [(row[0], path) for path in paths],
+                )
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('tip', ?)", (new_tip,))
+        log.info(f"    -> Indexed {len(commits)} new commits")
+        return len(commits)
+
+    def query(
+        self,
+        user=None,
+        host=None,
+        staging_dir=None,
+        path=None,
+        since=None,
+        until=None,
+        limit=None,
+    ):
+        """
+        Returns the indexed commits matching all the given criteria, newest first.
+
+        Parameters:
+            user(str): User who deployed.
+            host(str): Host the suite was deployed from.
+            staging_dir(str): Staging directory the suite was deployed from.
+            path(str): File path or glob pattern (see staging.match_path) changed by the commit.
+            since(float): Only commits after this timestamp.
+            until(float): Only commits before this timestamp.
+            limit(int): Maximum number of commits returned.
+
+        Returns:
+            List of dictionaries with the commit hash, time, author, deploy user, host,
+            staging directory, message and changed files.
+        """
+        conditions = []
+        params = []
+        for column, value in [
+            ("deploy_user", user),
+            ("deploy_host", host),
+            ("staging_dir", staging_dir),
+        ]:
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            conditions.append("time >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("time <= ?")
+            params.append(until)
+        if path is not None:
+            # restrict the glob matching to the files below the static part of the pattern
+            prefix = static_prefix(path)
+            files_condition = "match_path(path, ?)"
+            files_params = [path]
+            if prefix:
+                files_condition += " AND (path = ? OR (path > ? AND path < ?))"
+                files_params += [prefix, f"{prefix}/", f"{prefix}0"]
+            conditions.append(
+                f"hexsha IN (SELECT hexsha FROM files WHERE {files_condition})"
+            )
+            params += files_params
+
+        sql = f"SELECT {', '.join(COLUMNS)} FROM commits"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY rowid DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        results = []
+        for row in self.db.execute(sql, params).fetchall():
+            entry = dict(zip(COLUMNS, row))
+            entry["files"] = [
+                file
+                for (file,) in self.db.execute(
+                    "SELECT path FROM files WHERE hexsha = ? ORDER BY rowid",
+                    (entry["hexsha"],),
+                )
+            ]
+            results.append(entry)
+        return results
+
+
+def parse_time(value):
+    """
+    Parses an ISO date (e.g. 2024-01-31 or "2024-01-31 12:00") into a timestamp.
+    """
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Invalid date {value}, expected YYYY-MM-DD[ HH:MM[:SS]]"
+        )
+
+
+def get_parser():
+    description = "Query the deployment history of a target git repository."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("target", help="Path to target git repository on host")
+    parser.add_argument("--host", default="localhost", help="Target host")
+    parser.add_argument("--user", default=os.getenv("USER"), help="Deploy user")
+    parser.add_argument("--local", help="Path to the local git repository (optional)")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't reuse a cached clone of the target",
+    )
+    parser.add_argument("--index", help="Path to the history index (optional)")
+    parser.add_argument("--deployed-by", help="Only deployments by this user")
+    parser.add_argument("--from-host", help="Only deployments from this host")
+    parser.add_argument("--stage", help="Only deployments from this staging directory")
+    parser.add_argument(
+        "--path", help="Only deployments changing this file, folder or glob pattern"
+    )
+    parser.add_argument(
+        "--since", type=parse_time, help="Only deployments after this date"
+    )
+    parser.add_argument(
+        "--until", type=parse_time, help="Only deployments before this date"
+    )
+    parser.add_argument("--limit", type=int, help="Maximum number of deployments shown")
+    parser.add_argument(
+        "--files", action="store_true", help="Show the files changed by each deployment"
+    )
+    parser.add_argument("--json", action="store_true", help="Output in JSON format")
+    add_profile_arguments(parser)
+    return parser
+
+
+@profiled
+def main(args=None):
+    parser = get_parser()
+    args = parser.parse_args()
+
+    repos = GitRepositories(
+        host=args.host,
+        user=args.user,
+        target_repo=args.target,
+        local_repo=args.local,
+        use_cache=not args.no_cache,
+        clone_mode="blobless",
+        checkout=False,
+    )
+    repos.fetch("target")
+    # the cached clone may have been made shallow by a previous deployment
+    repos.unshallow()
+
+    index_path = args.index or get_index_path(repos.user, repos.host, args.target)
+    history = DeploymentHistory(repos.repo, index_path)
+    history.update(f"target/{repos.default_branch}")
+    results = history.query(
+        user=args.deployed_by,
+        host=args.from_host,
+        staging_dir=args.stage,
+        path=args.path,
+        since=args.since,
+        until=args.until,
+        limit=args.limit,
+    )
+    history.close()
+    repos.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for entry in results:
+        date = datetime.fromtimestamp(entry["time"]).isoformat(
+            sep=" ", timespec="seconds"
+        )
+        if entry["deploy_user"] is not None:
+            origin = f"{entry['deploy_user']} from {entry['deploy_host']}:{entry['staging_dir']}"
+        else:
+            origin = entry["author"]
+        print(f"{entry['hexsha'][:10]}  {date}  {origin}")
+        for line in entry["message"].splitlines():
+            print(f"    {line}")
+        if args.files:
+            for file in entry["files"]:
+                print(f"    - {file}")
+
+
+if __name__ == "__main__":
+    main()
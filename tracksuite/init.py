@@ -1,10 +1,15 @@
 import argparse
+import json
 import os
+import shlex
 import tempfile
 
 import git
 
 from tracksuite import LOGGER as log
+from tracksuite.metrics import add_metrics_arguments, record, span
+from tracksuite.profiling import add_profile_arguments, profiled
+from tracksuite.ssh import get_git_environment, get_ssh_pool
 from tracksuite.utils import run_cmd
 
 
@@ -39,14 +44,26 @@ class Client:
         """
         raise NotImplementedError
 
+    def run_script(self, script, args=None):
+        """
+        Run a shell script on host in a single call, passing it through stdin.
+
+        Parameters:
+            script(str): Content of the script.
+            args(list): Arguments of the script (optional).
+        """
+        raise NotImplementedError
+
 
 class SSHClient(Client):
     """
     SSH client class to run commands on remote host.
+    The ssh connection is shared with the other commands of the process, see SSHConnectionPool.
     """
 
-    def __init__(self, host, user, ssh_options=None):
-        self.ssh_command = f"ssh {user}@{host} "
+    def __init__(self, host, user, ssh_options=None, pool=None):
+        pool = get_ssh_pool() if pool is None else pool
+        self.ssh_command = f"{pool.ssh_command()} {user}@{host} "
         if ssh_options:
             self.ssh_command += ssh_options
         super().__init__(host, user)
@@ -73,6 +90,10 @@ class SSHClient(Client):
         value = run_cmd(ssh_command)
         return value
 
+    def run_script(self, script, args=None):
+        command = f"{self.ssh_command} sh -s -- {shlex.join(args or [])}"
+        return run_cmd(command, input=script)
+
 
 class LocalHostClient(Client):
     """
@@ -103,13 +124,66 @@ class LocalHostClient(Client):
         value = run_cmd(full_command, cwd=dir)
         return value
 
+    def run_script(self, script, args=None):
+        return run_cmd(f"sh -s -- {shlex.join(args or [])}", input=script)
+
+
+# Creates the target repository and its first commit, then prints a JSON status
+# on the last line of its output: "ok" with the commit hash, "exists" or "error".
+INIT_SCRIPT = r"""
+target_dir="$1"
+
+status() {
+    output=$(printf '%s' "$3" | sed -e 's/\\/\\\\/g' -e 's/"/\\"/g' -e 's/\t/ /g' | awk '{printf "%s\\n", $0}')
+    printf '\n{"status": "%s", "commit": "%s", "output": "%s"}\n' "$1" "$2" "$output"
+    exit 0
+}
+
+output=$(mkdir -p "$target_dir" 2>&1) || status error "" "$output"
+cd "$target_dir" 2>/dev/null || status error "" "Could not enter $target_dir"
+[ -e .git ] && status exists "" ""
+
+output=$(
+    git init 2>&1 &&
+    git config --local receive.denyCurrentBranch updateInstead &&
+    git config --local uploadpack.allowFilter true &&
+    touch dummy.txt &&
+    git add . 2>&1 &&
+    git commit -m 'first commit' 2>&1
+) || status error "" "$output"
+
+commit=$(git rev-parse HEAD 2>&1) || status error "" "$commit"
+status ok "$commit" "$output"
+"""
+
+
+def init_target(client, target_dir):
+    """
+    Initialise the target git repository with a first commit, in a single call to the host.
+
+    Parameters:
+        client(Client): Client to the target host.
+        target_dir(str): The target git repository.
+
+    Returns:
+        Dictionary with the status ("ok", "exists" or "error"),
+        the hash of the first commit and the output of the commands.
+    """
+    ret = client.run_script(INIT_SCRIPT, [target_dir])
+    lines = [line for line in ret.stdout.splitlines() if line.strip()]
+    try:
+        return json.loads(lines[-1])
+    except (IndexError, ValueError):
+        return {"status": "error", "commit": "", "output": ret.stdout}
+
 
 def setup_remote(host, user, target_dir, remote=None, force=False):
     """
     Setup target and remote repositories.
     Steps:
         - SSH to host, creates the git repository on target_dir
-        - Create first dummy commit
+          with a first dummy commit, in a single call
+        - Check the target repository is reachable through git
         - (optional) git push to remote backup repository
 
     Parameters:
@@ -118,6 +192,9 @@ def setup_remote(host, user, target_dir, remote=None, force=False):
         target_dir(str): The target git repository.
         remote(str): The remote backup git repository (optional).
         force(bool): force push to backup.
+
+    Returns:
+        The hash of the first commit.
     """
     log.info(f"Creating remote repository {target_dir} on host {host} with user {user}")
     # for test purpose with /tmp folders, stay local with localhost
@@ -128,61 +205,53 @@ def setup_remote(host, user, target_dir, remote=None, force=False):
         ssh = SSHClient(host, user)
         target_repo = f"ssh://{user}@{host}:{target_dir}"
 
-    # create folder and make sure it exists
-    ret = ssh.exec(f"mkdir -p {target_dir}; exit 0")
-    if not ssh.is_path(target_dir):
+    with span("init"):
+        status = init_target(ssh, target_dir)
+    if status["status"] == "exists":
+        raise Exception(
+            f"Git repo {target_dir} already initialised. Cleanup folder or skip initialisation."
+        )
+    elif status["status"] != "ok":
         raise Exception(
             f"Target directory {target_dir} not properly created on {host} with user {user}\n\n"
-            + ret.stdout
+            + status["output"]
         )
-
-    target_git = os.path.join(target_dir, ".git")
-    if ssh.is_path(target_git):
+    commit = status["commit"]
+    log.info(f"    -> First commit {commit}")
+
+    # making sure the repository is reachable through git
+    git_env = get_git_environment(target_repo, remote)
+    git_cmd = git.cmd.Git()
+    git_cmd.update_environment(**git_env)
+    with span("ls-remote"):
+        heads = git_cmd.ls_remote(target_repo, "HEAD").split()
+    if not heads or heads[0] != commit:
         raise Exception(
-            f"Git repo {target_dir} already initialised. Cleanup folder or skip initialisation."
+            f"Target repository {target_repo} is not reachable through git, "
+            + f"expected HEAD at {commit} but found {heads[0] if heads else None}"
         )
-    else:
-        commands = [
-            "git init",
-            "[ -d .git ] && echo 'init complete' || exit 1",
-            "git config --local receive.denyCurrentBranch updateInstead",
-            "touch dummy.txt",
-            "git add .",
-            "git commit -am 'first commit'",
-            "exit 0",
-        ]
-        ssh.exec(commands, dir=target_dir)
-        if not ssh.is_path(os.path.join(target_dir, ".git")):
-            raise Exception(
-                f"Target directory {target_dir} not properly created on {host} with user {user}"
-            )
-
-        # making sure we can clone the repository
-        if not ssh.is_path(target_git):
-            log.error(
-                f"Target directory {target_dir} not properaly created on {host} with user {user}"
-            )
-            raise Exception(ret.stdout)
 
+    if remote:
         with tempfile.TemporaryDirectory() as tmp_repo:
-            repo = git.Repo.clone_from(target_repo, tmp_repo)
-
-            if remote:
+            with span("clone"):
+                repo = git.Repo.clone_from(target_repo, tmp_repo, env=git_env)
+            try:
+                repo.create_remote("backup", url=remote)
+                remote_repo = repo.remotes["backup"]
                 try:
-                    repo.create_remote("backup", url=remote)
-                    remote_repo = repo.remotes["backup"]
-                    try:
+                    with span("push"):
                         remote_repo.push(force=force).raise_if_error()
-                    except git.exc.GitCommandError:
-                        raise git.exc.GitCommandError(
-                            f"Could not push changes to remote repository {remote}.\n"
-                            + "Check configuration and states of remote repository!"
-                        )
-                except Exception:
-                    raise Exception(
-                        f"Could not push first commit to backup repository {remote}! "
-                        + "Please check the repository is empty."
+                except git.exc.GitCommandError:
+                    raise git.exc.GitCommandError(
+                        f"Could not push changes to remote repository {remote}.\n"
+                        + "Check configuration and states of remote repository!"
                     )
+            except Exception:
+                raise Exception(
+                    f"Could not push first commit to backup repository {remote}! "
+                    + "Please check the repository is empty."
+                )
+    return commit
 
 
 def get_parser():
@@ -198,9 +267,12 @@ def get_parser():
         action="store_true",
         help="No prompt, --force will go through without user input",
     )
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
     return parser
 
 
+@profiled
 def main(args=None):
     parser = get_parser()
     args = parser.parse_args()
@@ -214,14 +286,16 @@ def main(args=None):
         if check != "Y":
             exit(1)
 
-    log.info("Initialisation options:")
-    log.info(f"    - host: {args.host}")
-    log.info(f"    - user: {args.user}")
-    log.info(f"    - target: {args.target}")
-    log.info(f"    - backup: {args.backup}")
-    log.info(f"    - force push: {force}")
+    # recorded after the confirmation, so that the timing does not include it
+    with record("init", args.metrics, log):
+        log.info("Initialisation options:")
+        log.info(f"    - host: {args.host}")
+        log.info(f"    - user: {args.user}")
+        log.info(f"    - target: {args.target}")
+        log.info(f"    - backup: {args.backup}")
+        log.info(f"    - force push: {force}")
 
-    setup_remote(args.host, args.user, args.target, args.backup, force)
+        setup_remote(args.host, args.user, args.target, args.backup, force)
 
 
 if __name__ == "__main__":
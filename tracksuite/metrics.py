@@ -0,0 +1,216 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+# operation being recorded, spans are ignored outside of an operation
+_current = None
+
+
+def add_metrics_arguments(parser):
+    """
+    Adds the --metrics option to a command line parser, see record.
+    """
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Write the timing of each phase to a file (Prometheus format if FILE ends with .prom, JSON otherwise)",
+    )
+    return parser
+
+
+@dataclass
+class Span:
+    """
+    A timed phase of an operation (clone, fetch, diff, stage, commit, push, ecflow:<call>...).
+    start is relative to the start of the operation, times are in seconds.
+    """
+
+    name: str
+    start: float
+    duration: float = 0.0
+    bytes: Optional[int] = None
+
+
+@dataclass
+class Metrics:
+    """
+    Timing of the phases of a tracksuite operation.
+    """
+
+    operation: str
+    timestamp: float = field(default_factory=time.time)
+    duration: float = 0.0
+    spans: List[Span] = field(default_factory=list)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        # time spent out of the operation, e.g. waiting for a confirmation
+        self._excluded = 0.0
+
+    def elapsed(self):
+        """
+        Returns the time since the start of the operation, without the excluded time.
+        """
+        return time.perf_counter() - self._start - self._excluded
+
+    def add(self, span):
+        # spans can be recorded from several threads (concurrent fetches, fleet runs)
+        with self._lock:
+            self.spans.append(span)
+
+    def phases(self):
+        """
+        Returns the total duration, bytes and count of the spans of each phase name.
+        """
+        phases = {}
+        for span in self.spans:
+            phase = phases.setdefault(
+                span.name, {"duration": 0.0, "bytes": None, "count": 0}
+            )
+            phase["duration"] += span.duration
+            phase["count"] += 1
+            if span.bytes is not None:
+                phase["bytes"] = (phase["bytes"] or 0) + span.bytes
+        return phases
+
+    def to_dict(self):
+        return {
+            "operation": self.operation,
+            "timestamp": self.timestamp,
+            "duration": self.duration,
+            "spans": [asdict(span) for span in self.spans],
+        }
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text format, e.g. for the node exporter textfile collector.
+        """
+        operation = _escape_label(self.operation)
+        lines = [
+            "# HELP tracksuite_operation_duration_seconds Duration of the last tracksuite operation.",
+            "# TYPE tracksuite_operation_duration_seconds gauge",
+            f'tracksuite_operation_duration_seconds{{operation="{operation}"}} {self.duration}',
+            "# HELP tracksuite_operation_timestamp_seconds Start time of the last tracksuite operation.",
+            "# TYPE tracksuite_operation_timestamp_seconds gauge",
+            f'tracksuite_operation_timestamp_seconds{{operation="{operation}"}} {self.timestamp}',
+        ]
+        metrics = [
+            ("duration_seconds", "duration", "Time spent in each phase"),
+            ("bytes", "bytes", "Bytes processed in each phase"),
+            ("count", "count", "Number of times each phase ran"),
+        ]
+        phases = self.phases()
+        for suffix, key, help in metrics:
+            name = f"tracksuite_phase_{suffix}"
+            lines.append(f"# HELP {name} {help} of the last tracksuite operation.")
+            lines.append(f"# TYPE {name} gauge")
+            for phase, values in phases.items():
+                if values[key] is None:
+                    continue
+                labels = f'operation="{operation}",phase="{_escape_label(phase)}"'
+                lines.append(f"{name}{{{labels}}} {values[key]}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Writes the metrics to a file, in the Prometheus text format if its extension is .prom,
+        in JSON otherwise. The file is replaced atomically.
+        """
+        if path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def log(self, logger):
+        logger.info(f"Timing of {self.operation} ({self.duration:.3f}s):")
+        for phase, values in self.phases().items():
+            line = f"    - {phase}: {values['duration']:.3f}s"
+            if values["count"] > 1:
+                line += f" ({values['count']} times)"
+            if values["bytes"] is not None:
+                line += f", {values['bytes']} bytes"
+            logger.info(line)
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+@contextmanager
+def record(operation, path=None, logger=None):
+    """
+    Records the spans of an operation.
+    The metrics are written and logged at the end of the operation, even if it failed.
+
+    Usage:
+        with record("deploy") as metrics:
+            deployer.deploy()
+        print(metrics.phases())
+
+    Parameters:
+        operation(str): Name of the operation.
+        path(str): Optional file the metrics are written to, see Metrics.write.
+        logger(logging.Logger): Optional logger the timing is logged to.
+    """
+    global _current
+    previous, _current = _current, Metrics(operation)
+    metrics = _current
+    try:
+        yield metrics
+    finally:
+        metrics.duration = metrics.elapsed()
+        _current = previous
+        if logger is not None:
+            metrics.log(logger)
+        if path:
+            metrics.write(path)
+
+
+def is_recording():
+    """
+    Whether an operation is recorded, to skip computing values nobody will read.
+    """
+    return _current is not None
+
+
+@contextmanager
+def span(name, bytes=None):
+    """
+    Times a phase of the current operation. Does nothing if no operation is recorded.
+    The number of bytes can be given upfront or set on the yielded span.
+    """
+    metrics = _current
+    if metrics is None:
+        yield Span(name, 0.0, bytes=bytes)
+        return
+    start = time.perf_counter()
+    current = Span(name, metrics.elapsed(), bytes=bytes)
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - start
+        metrics.add(current)
+
+
+@contextmanager
+def excluded():
+    """
+    Excludes a block from the timing of the current operation,
+    e.g. while waiting for the user to confirm. Must not be used inside a span.
+    """
+    metrics = _current
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics._excluded += time.perf_counter() - start
@@ -24,10 +24,15 @@ Usage:
 
 import argparse
 import os
-
-import ecflow
+from typing import Any, cast
 
 from tracksuite.ecflow_client import EcflowClient
+from tracksuite.profiling import add_profile_arguments, profiled
+
+try:
+    import ecflow
+except ModuleNotFoundError:
+    ecflow = cast(Any, None)
 
 
 def get_state_icon(node):
@@ -264,9 +269,11 @@ def get_parser():
     parser.add_argument(
         "-f", "--format", default="raw", help="Output format (md, html, raw)"
     )
+    add_profile_arguments(parser)
     return parser
 
 
+@profiled
 def main(args=None):
     """
     CLI entry point for printing ecFlow node trees.
@@ -0,0 +1,98 @@
+import argparse
+import functools
+import os
+import sys
+
+from tracksuite import LOGGER as log
+
+PROFILE_MODES = ["cpu", "mem"]
+
+# number of allocation sites in the memory report
+TOP_ALLOCATIONS = 50
+
+
+def add_profile_arguments(parser):
+    """
+    Adds the --profile, --profile-mode and --profile-output options to a command line parser.
+    The profiling itself is done by the profiled decorator of the main function.
+    """
+    parser.add_argument("--profile", action="store_true", help="Profile the command")
+    parser.add_argument(
+        "--profile-mode",
+        default="cpu",
+        choices=PROFILE_MODES,
+        help="What to profile with --profile: cpu (cProfile, default) or mem (tracemalloc)",
+    )
+    parser.add_argument(
+        "--profile-output",
+        metavar="FILE",
+        help="Profile report, <command>.pstats (cpu) or <command>.mem.txt (mem) by default",
+    )
+    return parser
+
+
+def profiled(main):
+    """
+    Decorator of the main functions, running them under cProfile or tracemalloc
+    when --profile is given on the command line. Without it, main is called directly.
+    """
+
+    @functools.wraps(main)
+    def wrapper(args=None):
+        argv = sys.argv[1:] if args is None else args
+        if "--profile" not in argv:
+            return main(args)
+
+        parser = add_profile_arguments(argparse.ArgumentParser(add_help=False))
+        options, _ = parser.parse_known_args(argv)
+        if not options.profile:
+            return main(args)
+
+        command = os.path.basename(sys.argv[0]) or "tracksuite"
+        if options.profile_mode == "cpu":
+            return profile_cpu(
+                main, args, options.profile_output or f"{command}.pstats"
+            )
+        return profile_memory(
+            main, args, options.profile_output or f"{command}.mem.txt"
+        )
+
+    return wrapper
+
+
+def profile_cpu(main, args, output):
+    """
+    Runs main under cProfile and writes the statistics to output,
+    to be read with pstats or snakeviz.
+    """
+    import cProfile
+
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(main, args)
+    finally:
+        profile.dump_stats(output)
+        log.info(f"CPU profile written to {output}")
+
+
+def profile_memory(main, args, output):
+    """
+    Runs main under tracemalloc and writes the peak memory and
+    the top allocation sites at the end of the command to output.
+    """
+    import tracemalloc
+
+    tracemalloc.start(25)
+    try:
+        return main(args)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with open(output, "w") as f:
+            f.write(f"Peak traced memory: {peak} bytes\n")
+            f.write(f"Traced memory at exit: {current} bytes\n")
+            f.write(f"Top {TOP_ALLOCATIONS} allocation sites:\n")
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                f.write(f"{stat}\n")
+        log.info(f"Memory profile written to {output}")
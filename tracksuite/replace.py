@@ -1,8 +1,11 @@
 import argparse
+import json
 import os
 
 from tracksuite import LOGGER as log
-from tracksuite.ecflow_client import EcflowClient
+from tracksuite.ecflow_client import EcflowClient, SyncPlan, ecflow, plan_sync
+from tracksuite.metrics import add_metrics_arguments, record
+from tracksuite.profiling import add_profile_arguments, profiled
 
 
 def replace_on_server(
@@ -16,6 +19,9 @@ def replace_on_server(
     skip_status: bool = False,
     skip_attributes: bool = False,
     skip_repeat: bool = False,
+    dry_run: bool = False,
+    plan_file: str = None,
+    workers: int = 1,
 ):
     """
     Replace a suite on the server with a new definition file while keeping some attributes from the old suite.
@@ -31,6 +37,12 @@ def replace_on_server(
         skip_status (bool): If True, do not synchronise the status of the nodes.
         skip_attributes (bool): If True, do not synchronise attributes of the nodes.
         skip_repeat (bool): If True, do not synchronise repeat attributes of the nodes.
+        dry_run (bool): If True, only compute the changes, the suite is not replaced.
+        plan_file (str, optional): File the sync plan is written to, in JSON format.
+        workers (int): Number of requests sent concurrently to the server.
+
+    Returns:
+        SyncPlan: The changes synchronising the new suite with the old one.
     """
 
     log.warning(
@@ -45,27 +57,47 @@ def replace_on_server(
     # we need two clients because the defs and suite objects are updated as well
     # when we update the client from the server
     old_client = EcflowClient(host, port, enable_ssl)
-    new_client = EcflowClient(host, port, enable_ssl)
-
-    # stage the suite running on the server
-    old_suite = old_client.get_suite(name)
-
-    new_client.replace_on_server(node_path, definition, force=False)
 
-    new_suite = new_client.get_suite(name)
-
-    new_client.sync_node_recursive(
-        new_suite,
-        old_suite,
-        attributes=attributes,
-        skip_status=skip_status,
-        skip_attributes=skip_attributes,
-        skip_repeat=skip_repeat,
-    )
+    # stage the node running on the server
+    old_node = old_client.get_defs().find_abs_node(node_path)
+
+    if dry_run:
+        # the new node as it would be after the replace, without its status
+        defs = ecflow.Defs(definition) if isinstance(definition, str) else definition
+    else:
+        new_client = EcflowClient(host, port, enable_ssl)
+        new_client.replace_on_server(node_path, definition, force=False)
+        defs = new_client.get_defs()
+    new_node = defs.find_abs_node(node_path)
+    if new_node is None:
+        raise ValueError(f"Node {node_path} not found in the new definition")
+
+    # only the replaced node is synchronised
+    if old_node is None:
+        plan = SyncPlan(unmatched=[node_path])
+    else:
+        plan = plan_sync(
+            new_node,
+            old_node,
+            attributes=attributes,
+            skip_status=skip_status,
+            skip_attributes=skip_attributes,
+            skip_repeat=skip_repeat,
+        )
+    # the unmatched nodes are logged with the result of a real replace
+    plan.log(unmatched=dry_run)
+    if plan_file:
+        plan.write(plan_file)
+        log.info(f"Sync plan written to {plan_file}")
+    if dry_run:
+        return plan
+
+    result = new_client.execute_plan(plan, workers=workers)
+    result.log()
 
     # udpate new suite to check the status
     new_client.update()
-    new_suite = new_client.get_suite(name)
+    return plan
 
 
 def get_parser():
@@ -93,24 +125,47 @@ def get_parser():
     parser.add_argument(
         "--skip-repeat", help="Don't synchronise repeat", action="store_true"
     )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only compute the changes and print them (or write them to --plan), the suite is not replaced",
+    )
+    parser.add_argument(
+        "--plan", metavar="FILE", help="Write the sync plan to a file in JSON format"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of requests sent concurrently to the server",
+    )
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
     return parser
 
 
+@profiled
 def main(args=None):
     parser = get_parser()
     args = parser.parse_args()
-    replace_on_server(
-        name=args.name,
-        definition=args.def_file,
-        host=args.host,
-        port=args.port,
-        enable_ssl=args.enable_ssl,
-        node_path=args.node,
-        sync_variables=args.sync_variables,
-        skip_status=args.skip_status,
-        skip_attributes=args.skip_attributes,
-        skip_repeat=args.skip_repeat,
-    )
+    with record("replace", args.metrics, log):
+        plan = replace_on_server(
+            name=args.name,
+            definition=args.def_file,
+            host=args.host,
+            port=args.port,
+            enable_ssl=args.enable_ssl,
+            node_path=args.node,
+            sync_variables=args.sync_variables,
+            skip_status=args.skip_status,
+            skip_attributes=args.skip_attributes,
+            skip_repeat=args.skip_repeat,
+            dry_run=args.dry_run,
+            plan_file=args.plan,
+            workers=args.workers,
+        )
+    if args.dry_run and not args.plan:
+        print(json.dumps(plan.to_dict(), indent=2))
 
 
 if __name__ == "__main__":
@@ -1,9 +1,67 @@
 import os
+import shutil
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import git
 
 from tracksuite import LOGGER as log
+from tracksuite.cache import CloneCache
+from tracksuite.metrics import is_recording, span
+from tracksuite.ssh import get_git_environment
+
+
+class RemoteMovedError(Exception):
+    """
+    Raised when a remote repository is not at the expected git hash anymore,
+    typically because someone else pushed to it during a deployment.
+    """
+
+    def __init__(self, remote, expected, actual=None):
+        self.remote = remote
+        self.expected = expected
+        self.actual = actual
+        message = (
+            "Remote repositories have changed during deployment!\n"
+            + f"Remote {remote} expected at {expected}"
+        )
+        if actual is not None:
+            message += f" but found at {actual}"
+        super().__init__(
+            message + ".\nPlease check the state of the remote repositories"
+        )
+
+
+CLONE_MODES = ["full", "shallow", "blobless"]
+
+
+class GitProgress(git.RemoteProgress):
+    """
+    Logs the progress of a git clone, pull or push (debug level) as it arrives,
+    instead of buffering the output of the whole transfer.
+    """
+
+    def update(self, op_code, cur_count, max_count=None, message=""):
+        if op_code & self.END:
+            log.debug(f"    {self._cur_line}")
+
+    def line_dropped(self, line):
+        log.debug(f"    {line}")
+
+
+class RemotesError(Exception):
+    """
+    Raised when an operation failed on one or more remote repositories.
+    The errors and the results of the successful remotes are kept per remote.
+    """
+
+    def __init__(self, errors, results=None):
+        self.errors = errors
+        self.results = results or {}
+        message = "Operation failed on remote repositories:"
+        for remote, error in errors.items():
+            message += f"\n    - {remote}: {error}"
+        super().__init__(message)
 
 
 class GitRepositories:
@@ -14,6 +72,9 @@ class GitRepositories:
         target_repo=None,
         backup_repo=None,
         local_repo=None,
+        use_cache=False,
+        clone_mode="full",
+        checkout=True,
     ):
         """
         Class used to deploy suites through git.
@@ -24,18 +85,39 @@ class GitRepositories:
             target_repo(str): Path to the target repository on the target host.
             backup_repo(str): URL of the backup repository.
             local_repo(str): Path to the local repository.
+            use_cache(bool): Reuse a cached clone of the target if local_repo is not given.
+            clone_mode(str): How to clone the target repository:
+                "full" (whole history), "shallow" (tip of the default branch only)
+                or "blobless" (whole history, file contents downloaded on demand).
+            checkout(bool): Populate the working tree of the local repository.
+                If False, the local repository is only used as index and object store.
         """
+        if clone_mode not in CLONE_MODES:
+            raise ValueError(
+                f"Unknown clone mode {clone_mode}, choose from {CLONE_MODES}"
+            )
+
+        # cache of the default branch hash of each remote, filled on first fetch
+        self._remote_hashes = {}
 
         self.deploy_user = os.getenv("USER")
         self.deploy_host = os.getenv("HOSTNAME")
         self.user = self.deploy_user if user is None else user
         self.host = self.deploy_host if host is None else host
 
+        # lock on the cached clone, held until close() or the end of the process
+        self._cache = CloneCache() if use_cache else None
+        self._cache_lock = None
+        if local_repo is None and use_cache:
+            local_repo, self._cache_lock = self._cache.acquire(
+                self.user, self.host, target_repo
+            )
         if local_repo is None:
             local_repo = tempfile.mkdtemp(prefix="suite_")
         self.local_dir = local_repo
 
         self.target_dir = target_repo
+        self.checkout = checkout
 
         # setup local repo
         # for test purpose with /tmp folders, stay local with localhost
@@ -46,50 +128,290 @@ class GitRepositories:
         else:
             self.target_repo = f"ssh://{self.user}@{self.host}:{target_repo}"
 
+        # share one ssh connection per host between all the git commands
+        git_env = get_git_environment(self.target_repo, backup_repo)
+
         try:
             log.info(f"    -> Loading local repo {local_repo}")
             self.repo = git.Repo(local_repo)
+            cloned = False
         except (git.exc.NoSuchPathError, git.exc.InvalidGitRepositoryError):
-            log.info(f"    -> Cloning from {self.target_repo}")
-            self.repo = git.Repo.clone_from(self.target_repo, local_repo)
+            log.info(f"    -> Cloning from {self.target_repo} ({clone_mode} clone)")
+            clone_options = {}
+            if clone_mode == "shallow":
+                clone_options["depth"] = 1
+            elif clone_mode == "blobless":
+                clone_options["filter"] = "blob:none"
+            if not checkout:
+                clone_options["no_checkout"] = True
+            if clone_mode != "full" and self.host == "localhost":
+                # local clones ignore depth and filter unless the git transport is used
+                clone_options["no_local"] = True
+            try:
+                with span("clone") as clone_span:
+                    self.repo = git.Repo.clone_from(
+                        self.target_repo,
+                        local_repo,
+                        progress=GitProgress(),
+                        env=git_env,
+                        **clone_options,
+                    )
+                if is_recording():
+                    clone_span.bytes = self._storage_size()
+            except Exception:
+                # never leave a broken clone behind in the cache
+                if self._cache_lock is not None:
+                    shutil.rmtree(local_repo, ignore_errors=True)
+                raise
             self.repo.remotes["origin"].rename("target")
+            if not checkout:
+                # fill the index without writing any file
+                self.repo.git.read_tree("HEAD")
+            cloned = True
+        self.repo.git.update_environment(**git_env)
 
         # get the name of the default branch
         self.default_branch = self.repo.active_branch.name
 
+        # a fresh clone is as good as a fetch of the target
+        if cloned:
+            self._remote_hashes["target"] = self._get_tracking_hash("target")
+        elif self._cache_lock is not None:
+            self.update_cached_clone()
+
         # link with backup repo
         self.backup_repo = backup_repo
         if backup_repo and "backup" not in self.repo.remotes:
             log.info(f"    -> Creating backup remote {backup_repo}")
             self.repo.create_remote("backup", url=backup_repo)
+            # fetch the remotes not fetched yet at the same time
+            self.fetch_remotes()
             self.sync_remotes()
+        elif backup_repo and self.repo.remotes["backup"].url != backup_repo:
+            log.info(f"    -> Updating backup remote {backup_repo}")
+            self.repo.remotes["backup"].set_url(backup_repo)
+
+    def update_cached_clone(self):
+        """
+        Bring a cached clone to the state of the target repository.
+        Any leftover from a previous invocation (unpushed commit, untracked files) is discarded.
+        Without checkout, only the index is reset and the working tree is left untouched.
+        """
+        log.info(f"    -> Updating cached clone {self.local_dir}")
+        self.fetch("target", force=True)
+        target_branch = f"target/{self.default_branch}"
+        if self.checkout:
+            self.repo.git.reset("--hard", target_branch)
+            self.repo.git.clean("-ffdx")
+        else:
+            self.repo.git.reset("--mixed", "-q", target_branch)
+
+    def is_shallow(self):
+        """
+        Returns True if the local repository is a shallow clone.
+        """
+        return self.repo.git.rev_parse("--is-shallow-repository") == "true"
+
+    def deepen(self, n_commits):
+        """
+        Make sure that the last n_commits ancestors of the default branch are available
+        in a shallow local repository, by fetching only the missing history from the target.
+
+        Parameters:
+            n_commits(int): Number of commits needed behind the tip of the default branch.
+        """
+        if not self.is_shallow():
+            return
+        log.info(f"    -> Fetching the last {n_commits} commits from target")
+        self.repo.git.fetch("target", self.default_branch, depth=n_commits + 1)
+
+    def unshallow(self, tags=False):
+        """
+        Fetch the full history of the target in a shallow local repository.
+
+        Parameters:
+            tags(bool): Fetch the tags of the target as well.
+        """
+        if not self.is_shallow():
+            return
+        log.info("    -> Fetching the full history from target")
+        options = ["--tags"] if tags else []
+        size = self._storage_size() if is_recording() else None
+        with span("fetch") as fetch_span:
+            self.repo.git.fetch("target", "--unshallow", *options)
+        if size is not None:
+            fetch_span.bytes = max(0, (self._storage_size() or 0) - size)
+
+    def close(self):
+        """
+        Release the lock on the cached clone, if any.
+        """
+        if self._cache_lock is not None:
+            self._cache.release(self._cache_lock)
+            self._cache_lock = None
 
     def pull_remotes(self):
         """
-        Git pull the remote repository to the local repository
+        Fetch the target and backup repositories concurrently,
+        then fast-forward the local repository to the target.
+        Without checkout, only the index follows and the working tree is left untouched.
         """
-        remote_repo = self.repo.remotes["target"]
-        remote_repo.pull()
+        self.fetch_remotes(force=True)
+        target_branch = f"target/{self.default_branch}"
+        with span("pull"):
+            if self.checkout:
+                self.repo.git.merge("--ff-only", target_branch)
+            elif self.repo.is_ancestor("HEAD", target_branch):
+                self.repo.git.reset("--mixed", "-q", target_branch)
+            else:
+                raise Exception(
+                    f"Local repository {self.local_dir} cannot be fast-forwarded "
+                    + f"to {target_branch}"
+                )
         self.check_sync_local_remote("target")
         if self.backup_repo:
             self.sync_remotes()
 
-    def push(self, remote):
+    def push(self, remote, expected=None):
         """
-        Pushes the local state to the remote repository
+        Pushes the local state to the remote repository.
+        If an expected hash is given, it is sent with the push as a lease and
+        the remote only accepts the update if its branch is still at that hash,
+        in the same round trip.
 
         Parameters:
             remote(str): Name of the remote repository (typically "target").
+            expected(str): Expected git hash of the remote default branch (optional).
+
+        Raises:
+            RemoteMovedError: if the remote is not at the expected hash anymore.
         """
         remote_repo = self.repo.remotes[remote]
+        branch = self.default_branch
+        options = {}
+        if expected is not None:
+            options["force_with_lease"] = f"refs/heads/{branch}:{expected}"
+        # objects the remote does not have yet, as far as we know
+        push_bytes = None
+        if is_recording():
+            push_bytes = self._objects_size(branch, self._get_tracking_hash(remote))
         try:
-            remote_repo.push().raise_if_error()
+            with span("push", bytes=push_bytes):
+                push_infos = remote_repo.push(
+                    f"{branch}:{branch}", progress=GitProgress(), **options
+                )
+            for info in push_infos:
+                if info.flags & info.REJECTED and "stale info" in info.summary:
+                    self._remote_hashes.pop(remote, None)
+                    raise RemoteMovedError(remote, expected)
+            push_infos.raise_if_error()
         except git.exc.GitCommandError:
             raise git.exc.GitCommandError(
                 f"Could not push changes to remote repository {remote}. "
                 + "Check configuration and the state of the remote repository! "
                 + "The remote repository might have uncommited changes."
             )
+        self._remote_hashes[remote] = self._get_tracking_hash(remote)
+
+    def fetch(self, remote, force=False):
+        """
+        Fetch a remote repository and cache the git hash of its default branch.
+        The remote is only fetched once per session unless force is set.
+
+        Parameters:
+            remote(str): Name of the remote repository (typically "target").
+            force(bool): Fetch even if the remote hash is already cached.
+
+        Returns:
+            The git hash of the default branch of the remote.
+        """
+        if force or remote not in self._remote_hashes:
+            old_hash = self._get_tracking_hash(remote)
+            # plain git fetch, safe to run concurrently on different remotes
+            with span("fetch") as fetch_span:
+                self.repo.git.fetch(remote)
+            self._remote_hashes[remote] = self._get_tracking_hash(remote)
+            if is_recording():
+                fetch_span.bytes = self._objects_size(
+                    self._remote_hashes[remote], old_hash
+                )
+        return self._remote_hashes[remote]
+
+    def fetch_remotes(self, force=False):
+        """
+        Fetch the target and backup repositories concurrently.
+
+        Parameters:
+            force(bool): Fetch even if the remote hashes are already cached.
+
+        Returns:
+            Dictionary of the git hash of the default branch of each remote.
+        """
+        return self._run_on_remotes(lambda remote: self.fetch(remote, force))
+
+    def _remote_names(self):
+        """
+        Names of the remote repositories handled by this object.
+        """
+        if self.backup_repo:
+            return ["target", "backup"]
+        return ["target"]
+
+    def _run_on_remotes(self, func, remotes=None):
+        """
+        Run a function on each remote repository concurrently.
+        Errors are collected per remote and raised together once all remotes are done,
+        except a RemoteMovedError on a single remote, which is raised as is.
+
+        Parameters:
+            func(callable): Function taking the remote name as argument.
+            remotes(list): Names of the remotes, target and backup by default.
+
+        Returns:
+            Dictionary of the result of the function for each remote.
+        """
+        remotes = remotes or self._remote_names()
+        with ThreadPoolExecutor(max_workers=len(remotes)) as executor:
+            futures = {remote: executor.submit(func, remote) for remote in remotes}
+        results = {}
+        errors = {}
+        for remote, future in futures.items():
+            try:
+                results[remote] = future.result()
+            except Exception as e:
+                errors[remote] = e
+        if len(errors) == 1:
+            (error,) = errors.values()
+            if isinstance(error, RemoteMovedError):
+                raise error
+        if errors:
+            raise RemotesError(errors, results)
+        return results
+
+    def ls_remote(self, remote):
+        """
+        Query the git hash of the default branch of a remote repository,
+        without fetching any object, and refresh the cache with it.
+
+        Parameters:
+            remote(str): Name of the remote repository (typically "target").
+
+        Returns:
+            The git hash of the default branch of the remote.
+        """
+        with span("ls-remote"):
+            output = self.repo.git.ls_remote(
+                remote, f"refs/heads/{self.default_branch}"
+            )
+        hash = output.split()[0] if output else None
+        self._remote_hashes[remote] = hash
+        return hash
+
+    def clear_remote_cache(self):
+        """
+        Forget the cached remote hashes, the next checks will fetch the remotes again.
+        """
+        self._remote_hashes = {}
 
     def check_sync_remotes(self, remote1, remote2):
         """
@@ -103,12 +425,8 @@ class GitRepositories:
         Returns:
             The matching git hash.
         """
-        remote_repo1 = self.repo.remotes[remote1]
-        remote_repo2 = self.repo.remotes[remote2]
-        remote_repo1.fetch()
-        remote_repo2.fetch()
-        hash1 = self.get_hash_remote(remote1)
-        hash2 = self.get_hash_remote(remote2)
+        hash1 = self.fetch(remote1)
+        hash2 = self.fetch(remote2)
         if hash1 != hash2:
             log.info(f"Remote {remote1} hash {hash1}")
             log.info(f"Remote {remote2} hash {hash2}")
@@ -117,18 +435,73 @@ class GitRepositories:
             )
         return hash1
 
-    def get_hash_remote(self, remote):
+    def _objects_size(self, rev, exclude):
+        """
+        Returns the size on disk of the objects reachable from rev but not from exclude,
+        an estimate of the bytes transferred by a fetch or a push.
+        Returns None if the size is unknown, e.g. when there is no previous hash.
+        """
+        if rev is None or exclude is None:
+            return None
+        if rev == exclude:
+            return 0
+        try:
+            # missing objects of partial clones are not downloaded
+            return int(
+                self.repo.git.rev_list(
+                    "--objects",
+                    "--disk-usage",
+                    "--missing=allow-any",
+                    rev,
+                    "--not",
+                    exclude,
+                )
+            )
+        except (git.exc.GitCommandError, ValueError):
+            return None
+
+    def _storage_size(self):
+        """
+        Returns the size in bytes of the objects of the local repository.
+        """
+        try:
+            counts = dict(
+                line.split(": ", 1)
+                for line in self.repo.git.count_objects("-v").splitlines()
+            )
+            return (int(counts["size"]) + int(counts["size-pack"])) * 1024
+        except (git.exc.GitCommandError, KeyError, ValueError):
+            return None
+
+    def _get_tracking_hash(self, remote):
+        """
+        Get the git hash of the local remote-tracking branch of a remote.
+        Returns None if the remote has no default branch yet.
+        """
+        # read the ref files directly, this is safe to call from several threads
+        ref_path = f"refs/remotes/{remote}/{self.default_branch}"
+        try:
+            return git.SymbolicReference.dereference_recursive(self.repo, ref_path)
+        except ValueError:
+            return None
+
+    def get_hash_remote(self, remote, refresh=False):
         """
         Get the git hash of a remote repository on the default branch.
+        The cached hash from the last fetch is used unless refresh is set.
 
         Parameters:
             remote(str): Name of the remote repository (typically "target").
+            refresh(bool): Query the remote with ls-remote instead of using the cache.
 
         Returns:
             The git hash of the default branch.
         """
-        remote_branch = self.repo.remotes[remote].refs[self.default_branch]
-        return remote_branch.commit.hexsha
+        if refresh:
+            return self.ls_remote(remote)
+        if remote in self._remote_hashes:
+            return self._remote_hashes[remote]
+        return self._get_tracking_hash(remote)
 
     def check_sync_local_remote(self, remote):
         """
@@ -141,9 +514,7 @@ class GitRepositories:
         Returns:
             The matching git hash.
         """
-        remote_repo = self.repo.remotes[remote]
-        remote_repo.fetch()
-        hash_target = self.get_hash_remote(remote)
+        hash_target = self.fetch(remote)
         hash_local = self.repo.active_branch.commit.hexsha
         if hash_target != hash_local:
             log.info(f"Local hash {hash_local}")
@@ -167,23 +538,43 @@ class GitRepositories:
             log.info("WARNING! Backup repository outdated. Pushing update to backup")
             self.push("backup")
 
-    def push_to_remotes(self):
+    def push_to_remotes(self, expected=None):
         """
-        Push the changes to the remote repository.
+        Push the changes to the target repository, then to the backup repository
+        once the target has accepted them, and check that all remotes are at the local git hash.
+        The backup is never left on a commit the target did not receive.
+
+        Parameters:
+            expected(str): Expected git hash of the remotes, used as push lease (optional).
+
+        Raises:
+            RemoteMovedError: if a remote is not at the expected hash anymore.
         """
         log.info(f"    -> Git push to {self.target_repo}")
-        self.push("target")
+        self.push("target", expected)
         if self.backup_repo:
             log.info(f"    -> Git push to backup repository {self.backup_repo}")
-            self.push("backup")
+            self.push("backup", expected)
+
+        hash_local = self.repo.active_branch.commit.hexsha
+        for remote in self._remote_names():
+            if self.get_hash_remote(remote) != hash_local:
+                raise Exception(
+                    f"Local ({self.local_dir}) and remote ({remote}) git repositories not in sync after push!"
+                )
 
     def check_state_remote(self, hash, remote):
-        hash_check = self.get_hash_remote(remote)
+        """
+        Check that the remote repository has not changed since the given git hash.
+        The remote is queried with ls-remote, no fetch is needed.
+
+        Parameters:
+            hash(str): The expected git hash of the remote.
+            remote(str): Name of the remote repository (typically "target").
+        """
+        hash_check = self.get_hash_remote(remote, refresh=True)
         if hash_check != hash:
-            raise Exception(
-                "Remote repositories have changed during deployment!\n \
-                Please check the state of the remote repositories"
-            )
+            raise RemoteMovedError(remote, hash, hash_check)
 
     def check_repos(self):
         """
@@ -197,6 +588,7 @@ class GitRepositories:
                 "The repository has uncommitted changes. Stash or commit them before reverting."
             )
 
+        self.fetch_remotes()
         hash_init = self.check_sync_local_remote("target")
         if self.backup_repo:
             self.check_sync_local_remote("backup")
@@ -1,8 +1,14 @@
 import argparse
 import os
 
+import git
+
 from tracksuite import LOGGER as log
-from tracksuite.repos import GitRepositories
+from tracksuite.metrics import add_metrics_arguments, excluded, record, span
+from tracksuite.profiling import add_profile_arguments, profiled
+from tracksuite.repos import CLONE_MODES, GitRepositories
+
+REVERT_MODES = ["revert", "restore"]
 
 
 class GitRevert(GitRepositories):
@@ -13,17 +19,20 @@ class GitRevert(GitRepositories):
         user=None,
         backup_repo=None,
         local_repo=None,
+        use_cache=False,
+        clone_mode="full",
     ):
         """
         Class used to revert git repositories to a previous state.
 
         Parameters:
             target_repo(str): Path to the target repository on the target host.
-            n_state(int): Number of states to revert
             host(str): The target host.
             user(str): The deploying user.
             backup_repo(str): URL of the backup repository.
             local_repo(str): Path to the local repository.
+            use_cache(bool): Reuse a cached clone of the target if local_repo is not given.
+            clone_mode(str): How to clone the target: "full", "shallow" or "blobless".
         """
 
         log.info("Creating reverter:")
@@ -33,82 +42,206 @@ class GitRevert(GitRepositories):
             target_repo=target_repo,
             backup_repo=backup_repo,
             local_repo=local_repo,
+            use_cache=use_cache,
+            clone_mode=clone_mode,
         )
 
-    def revert(self, n_state, message=None):
+    def resolve_target(self, target):
+        """
+        Returns the commit to revert to, without walking the whole history.
+
+        Parameters:
+            target(int or str): Number of states to revert back from the tip of the
+                default branch, or a commit hash or tag.
+        """
+        if isinstance(target, int):
+            if target < 0:
+                raise ValueError(f"Cannot revert to {target} states back.")
+            self.deepen(target)
+            rev = f"HEAD~{target}"
+        else:
+            rev = target
+
+        try:
+            hexsha = self.repo.git.rev_parse("--verify", "--quiet", f"{rev}^{{commit}}")
+        except git.GitCommandError:
+            hexsha = None
+        if hexsha is None and not isinstance(target, int) and self.is_shallow():
+            # the distance to a hash or tag is unknown, fetch the rest of the history
+            self.unshallow(tags=True)
+            try:
+                hexsha = self.repo.git.rev_parse(
+                    "--verify", "--quiet", f"{rev}^{{commit}}"
+                )
+            except git.GitCommandError:
+                hexsha = None
+
+        if hexsha is None:
+            if isinstance(target, int):
+                raise Exception(
+                    f"The repository has less than {target + 1} commits. Cannot revert to {target} states back."
+                )
+            raise Exception(f"Could not find commit {target} in the repository.")
+
+        target_commit = self.repo.commit(hexsha)
+        if not self.repo.is_ancestor(target_commit, self.repo.head.commit):
+            raise Exception(
+                f"Commit {target} is not an ancestor of the current state. Cannot revert to it."
+            )
+        return target_commit
+
+    def preview(self, target):
+        """
+        Returns the summary of the changes a revert to the target would make,
+        without changing the index nor the working tree.
+
+        Parameters:
+            target(int or str): Number of states to revert back, or a commit hash or tag.
+        """
+        target_commit = self.resolve_target(target)
+        return self.repo.git.diff("HEAD", target_commit.hexsha, stat=True)
+
+    def revert(self, target, message=None, mode="revert"):
         """
         Revert a git repository to a previous state by creating a new commit
         that undoes changes since the target commit.
-        """
 
-        # Get the commit history and select the target commit
-        commits = list(self.repo.iter_commits())
-        if n_state > len(commits):
-            raise Exception(
-                f"The repository has only {len(commits)} commits. Cannot revert to {n_state} states back."
+        Parameters:
+            target(int or str): Number of states to revert back, or a commit hash or tag.
+            message(str): Optional message appended to the commit message.
+            mode(str): "revert" applies the inverse of every commit since the target,
+                "restore" commits the tree of the target commit as it is.
+        """
+        if mode not in REVERT_MODES:
+            raise ValueError(
+                f"Unknown revert mode {mode}, must be one of {REVERT_MODES}"
             )
 
-        target_commit = commits[n_state]  # n_state counts back from the latest commit
+        target_commit = self.resolve_target(target)
         log.info(f"    -> Reverting changes to commit: {target_commit.hexsha}")
         log.info(f"    -> Commit message: \n {target_commit.message}")
 
-        # Revert changes since the target commit
-        self.repo.git.revert(f"{target_commit.hexsha}..HEAD", no_commit=True)
-        commit_message = f"Revert changes since {n_state} commits back (reverting to commit {target_commit.hexsha})."
+        with span("revert"):
+            if mode == "restore":
+                # write the target tree in the index and the working tree in one go,
+                # the cost does not depend on the number of commits reverted
+                self.repo.git.read_tree(target_commit.hexsha, "-u", "--reset")
+            else:
+                # Revert changes since the target commit
+                self.repo.git.revert(f"{target_commit.hexsha}..HEAD", no_commit=True)
+        if isinstance(target, int):
+            since = f"{target} commits back"
+        else:
+            since = f"{target}"
+        commit_message = f"Revert changes since {since} (reverting to commit {target_commit.hexsha})."
         if message is not None:
             commit_message += f"\n{message}"
         self.repo.index.commit(commit_message)
+        return target_commit
 
 
-def main(args=None):
+def parse_state(state):
+    """
+    Parses the revert target given on the command line: a number of states to revert back,
+    or a commit hash or tag. Numbers of 7 digits or more are taken as commit hashes.
+    """
+    if state.isdigit() and len(state) < 7:
+        return int(state)
+    return state
+
+
+def get_parser():
     description = "Revert a git repository to a previous state."
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument("target", help="Path to target git repository on host")
-    parser.add_argument("n_state", type=int, help="Number of states to revert back")
+    parser.add_argument(
+        "state",
+        type=parse_state,
+        help="Number of states to revert back, or commit hash or tag to revert to",
+    )
     parser.add_argument("--host", default="localhost", help="Target host")
     parser.add_argument("--user", default=os.getenv("USER"), help="Deploy user")
     parser.add_argument("--message", help="Git message")
     parser.add_argument("--backup", help="URL to the backup git repository")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't reuse a cached clone of the target",
+    )
+    parser.add_argument(
+        "--clone-mode",
+        default="full",
+        choices=CLONE_MODES,
+        help="How to clone the target repository (full, shallow or blobless)",
+    )
+    parser.add_argument(
+        "--mode",
+        default="revert",
+        choices=REVERT_MODES,
+        help="Revert every commit since the target (revert) or commit the target state as it is (restore)",
+    )
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help="Only show the changes the revert would make",
+    )
     parser.add_argument(
         "--no_prompt",
         action="store_true",
         help="No prompt, --force will go through without user input",
     )
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
+    return parser
+
 
+@profiled
+def main(args=None):
+    parser = get_parser()
     args = parser.parse_args()
 
-    log.info("Revert options:")
-    log.info(f"    - target repo: {args.target}")
-    log.info(f"    - number of commits to revert to: {args.n_state}")
-    log.info(f"    - host: {args.host}")
-    log.info(f"    - user: {args.user}")
-    log.info(f"    - backup repo: {args.backup}")
-    log.info(f"    - git message: {args.message}")
-
-    reverter = GitRevert(
-        args.target,
-        host=args.host,
-        user=args.user,
-        backup_repo=args.backup,
-    )
-    log.info("Reverting git repository to a previous state")
-    hash_init = reverter.check_repos()
+    with record("revert", args.metrics, log):
+        log.info("Revert options:")
+        log.info(f"    - target repo: {args.target}")
+        log.info(f"    - state to revert to: {args.state}")
+        log.info(f"    - host: {args.host}")
+        log.info(f"    - user: {args.user}")
+        log.info(f"    - backup repo: {args.backup}")
+        log.info(f"    - git message: {args.message}")
+        log.info(f"    - revert mode: {args.mode}")
+
+        reverter = GitRevert(
+            args.target,
+            host=args.host,
+            user=args.user,
+            backup_repo=args.backup,
+            use_cache=not args.no_cache,
+            clone_mode=args.clone_mode,
+        )
+        log.info("Reverting git repository to a previous state")
+        hash_init = reverter.check_repos()
 
-    reverter.revert(args.n_state, args.message)
+        log.info("Changes to revert:")
+        log.info(reverter.preview(args.state))
+        if args.preview:
+            return
 
-    if not args.no_prompt:
-        check = input(
-            f"You are about to revert the git repository to the above previous commit ({args.n_state} commits back). Are you sure? (y/N)"  # noqa: E501
-        )
-        if check != "y":
-            exit(1)
+        target_commit = reverter.revert(args.state, args.message, mode=args.mode)
 
-    reverter.check_state_remote(hash_init, "target")
-    reverter.push_to_remotes()
+        if not args.no_prompt:
+            # the time waiting for the confirmation is not part of the timing
+            with excluded():
+                check = input(
+                    f"You are about to revert the git repository to the above previous commit ({target_commit.hexsha}). Are you sure? (y/N)"  # noqa: E501
+                )
+            if check != "y":
+                exit(1)
 
-    log.info(
-        f"Repository reverted with a new commit that undoes changes since {args.n_state} commits back."
-    )
+        reverter.push_to_remotes(expected=hash_init)
+
+        log.info(
+            f"Repository reverted with a new commit that undoes changes since {target_commit.hexsha}."
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,130 @@
+import atexit
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from tracksuite import LOGGER as log
+
+# seconds a master connection stays open without any client,
+# in case the process is killed before closing the pool
+CONTROL_PERSIST = 600
+
+
+class SSHConnectionPool:
+    def __init__(self, control_persist=CONTROL_PERSIST):
+        """
+        Pool of SSH master connections, one per user and host, shared by all the
+        ssh commands of a tracksuite operation (SSHClient commands and git fetches and pushes).
+        Only the first command to a host pays for the SSH handshake, the others are
+        multiplexed over its connection. The connections are closed at exit.
+
+        Parameters:
+            control_persist(int): Seconds a master connection stays open when unused.
+        """
+        self.control_persist = control_persist
+        self.control_dir = None
+        self._lock = threading.Lock()
+
+    def _get_control_dir(self):
+        with self._lock:
+            if self.control_dir is None:
+                # short path, unix sockets are limited to ~100 characters
+                self.control_dir = tempfile.mkdtemp(prefix="tracksuite_ssh_")
+                atexit.register(self.close)
+            return self.control_dir
+
+    def options(self):
+        """
+        Returns the ssh options to share the master connections of the pool.
+        """
+        control_path = os.path.join(self._get_control_dir(), "%C")
+        return [
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={control_path}",
+            "-o",
+            f"ControlPersist={self.control_persist}",
+        ]
+
+    def ssh_command(self, base="ssh"):
+        """
+        Returns the ssh command line using the pool.
+
+        Parameters:
+            base(str): ssh command to extend with the pool options.
+        """
+        return f"{base} {shlex.join(self.options())}"
+
+    def git_environment(self):
+        """
+        Returns the environment making git use the pool for its ssh transport.
+        An existing GIT_SSH_COMMAND is kept and extended.
+        """
+        base = os.getenv("GIT_SSH_COMMAND") or "ssh"
+        return {"GIT_SSH_COMMAND": self.ssh_command(base)}
+
+    def close(self):
+        """
+        Close all the master connections of the pool.
+        """
+        with self._lock:
+            control_dir, self.control_dir = self.control_dir, None
+        if control_dir is None:
+            return
+        for name in os.listdir(control_dir):
+            socket = os.path.join(control_dir, name)
+            # with an explicit control path, the destination is not used
+            try:
+                subprocess.run(
+                    ["ssh", "-o", f"ControlPath={socket}", "-O", "exit", "tracksuite"],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    timeout=10,
+                )
+            except (OSError, subprocess.SubprocessError) as exc:
+                log.debug(f"Could not close ssh master connection {socket}: {exc}")
+        shutil.rmtree(control_dir, ignore_errors=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_ssh_pool():
+    """
+    Returns the SSH connection pool of the process.
+    """
+    global _pool
+    # the pool is shared by the threads of fleet runs and concurrent fetches
+    with _pool_lock:
+        if _pool is None:
+            _pool = SSHConnectionPool()
+        return _pool
+
+
+def is_ssh_url(url):
+    """
+    Returns True if git reaches a repository URL through ssh:
+    ssh://[user@]host/path or the scp-like syntax [user@]host:path.
+    """
+    if not url:
+        return False
+    if "://" in url:
+        return url.split("://", 1)[0] in ["ssh", "git+ssh", "ssh+git"]
+    # scp-like syntax, a colon before the first slash
+    return ":" in url.split("/", 1)[0]
+
+
+def get_git_environment(*urls):
+    """
+    Returns the environment making git use the SSH connection pool for the given
+    repository URLs. It is empty if none of them is reached through ssh,
+    in which case the pool is not created.
+    """
+    if not any(is_ssh_url(url) for url in urls):
+        return {}
+    return get_ssh_pool().git_environment()
@@ -0,0 +1,350 @@
+import fnmatch
+import hashlib
+import json
+import os
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Tuple
+
+from tracksuite import LOGGER as log
+
+MANIFEST_NAME = "tracksuite_manifest.json"
+
+# files modified less than RACY_DELAY before a scan could change again
+# without any visible change of their size and mtime
+RACY_DELAY = 2 * 10**9  # nanoseconds
+
+CHUNK_SIZE = 1024**2
+
+
+def git_mode(st):
+    """
+    Returns the git file mode (as stored in the index) of a stat result.
+    """
+    if stat.S_ISLNK(st.st_mode):
+        return 0o120000
+    if st.st_mode & stat.S_IXUSR:
+        return 0o100755
+    return 0o100644
+
+
+def git_blob_hash(path, st):
+    """
+    Returns the git blob hash of a file, as computed by git hash-object.
+
+    Parameters:
+        path(str): Path of the file.
+        st(os.stat_result): lstat of the file.
+    """
+    if stat.S_ISLNK(st.st_mode):
+        content = os.fsencode(os.readlink(path))
+        return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+    sha = hashlib.sha1(b"blob %d\0" % st.st_size)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def scan_files(root):
+    """
+    Lists the files and symlinks of a directory in a single os.scandir pass,
+    skipping .git folders. Symlinks to directories are listed, not followed.
+
+    Returns:
+        Dictionary of path relative to root -> os.stat_result.
+    """
+    files = {}
+    folders = [""]
+    while folders:
+        folder = folders.pop()
+        with os.scandir(os.path.join(root, folder)) as entries:
+            for entry in entries:
+                path = f"{folder}/{entry.name}" if folder else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != ".git":
+                        folders.append(path)
+                else:
+                    files[path] = entry.stat(follow_symlinks=False)
+    return files
+
+
+def match_path(path, pattern):
+    """
+    Glob matching of a path relative to the suite root.
+    "*", "?" and "[...]" do not match "/", "**" matches any number of folders,
+    and a pattern matching a folder matches all the files below it.
+
+    Parameters:
+        path(str): Path of a file, "/" separated.
+        pattern(str): Glob pattern.
+    """
+    return _match_parts(path.split("/"), _pattern_parts(pattern))
+
+
+def _pattern_parts(pattern):
+    pattern = pattern.replace(os.sep, "/")
+    while pattern.startswith("./"):
+        pattern = pattern[2:]
+    return [part for part in pattern.strip("/").split("/") if part and part != "."]
+
+
+def _match_parts(parts, pattern_parts):
+    if not pattern_parts:
+        return True
+    head, rest = pattern_parts[0], pattern_parts[1:]
+    if head == "**":
+        return any(_match_parts(parts[i:], rest) for i in range(len(parts) + 1))
+    if not parts:
+        return False
+    return fnmatch.fnmatchcase(parts[0], head) and _match_parts(parts[1:], rest)
+
+
+def static_prefix(pattern):
+    """
+    Returns the leading folders of a glob pattern that contain no wildcard,
+    i.e. the part of the tree all the matching paths are below.
+    """
+    static = []
+    for part in _pattern_parts(pattern):
+        if any(char in part for char in "*?["):
+            break
+        static.append(part)
+    return "/".join(static)
+
+
+def select_files(root, patterns):
+    """
+    Lists the files of a directory matching glob patterns (see match_path).
+    Only the folders below the static part of each pattern are scanned.
+
+    Returns:
+        Dictionary of path relative to root -> os.stat_result.
+    """
+    files = {}
+    for pattern in patterns:
+        prefix = static_prefix(pattern)
+        fullpath = os.path.join(root, prefix)
+        if not os.path.lexists(fullpath):
+            continue
+        if os.path.isdir(fullpath) and not os.path.islink(fullpath):
+            listing = {
+                f"{prefix}/{path}" if prefix else path: st
+                for path, st in scan_files(fullpath).items()
+            }
+        else:
+            listing = {prefix: os.lstat(fullpath)}
+        files.update(
+            (path, st) for path, st in listing.items() if match_path(path, pattern)
+        )
+    return files
+
+
+@dataclass
+class StagingDiff:
+    """
+    Differences between a staged suite and the index of the local repository.
+    Paths are relative to the suite root, renamed files are (old path, new path) pairs.
+    The git blob hashes of the added, modified and renamed files are kept in hashes.
+    """
+
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    renamed: List[Tuple[str, str]] = field(default_factory=list)
+    added_bytes: int = 0
+    removed_bytes: int = 0
+    modified_bytes: int = 0
+    hashes: Dict[str, str] = field(default_factory=dict)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified or self.renamed)
+
+    def new_paths(self):
+        """
+        Returns the paths whose content comes from the staged suite.
+        """
+        return self.added + self.modified + [new for old, new in self.renamed]
+
+    def deleted_paths(self):
+        """
+        Returns the paths that disappear from the suite.
+        """
+        return self.removed + [old for old, new in self.renamed]
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, content):
+        content = dict(content)
+        content["renamed"] = [tuple(pair) for pair in content.get("renamed", [])]
+        return cls(**content)
+
+    @classmethod
+    def compare(cls, staged, indexed):
+        """
+        Computes the differences between the staged files and the indexed files.
+
+        Parameters:
+            staged(dict): path -> (git mode, git blob hash, size) of the staged files.
+            indexed(dict): path -> (git mode, git blob hash, size) of the indexed files.
+        """
+        diff = cls()
+        added = {}
+        for path, (mode, hexsha, size) in staged.items():
+            if path not in indexed:
+                added[path] = hexsha
+                diff.added_bytes += size
+            elif indexed[path][:2] != (mode, hexsha):
+                diff.modified.append(path)
+                diff.modified_bytes += size
+            else:
+                continue
+            diff.hashes[path] = hexsha
+
+        # removed files with the same content as an added file are renames
+        added_by_hash = {}
+        for path in sorted(added):
+            added_by_hash.setdefault(added[path], []).append(path)
+        for path in sorted(indexed):
+            if path in staged:
+                continue
+            mode, hexsha, size = indexed[path]
+            candidates = added_by_hash.get(hexsha)
+            if candidates:
+                new_path = candidates.pop(0)
+                del added[new_path]
+                diff.renamed.append((path, new_path))
+                diff.added_bytes -= size
+            else:
+                diff.removed.append(path)
+                diff.removed_bytes += size
+        diff.added = sorted(added)
+        diff.modified.sort()
+        return diff
+
+    def log(self):
+        """
+        Logs the differences in a human readable form.
+        """
+        log.info("Changes in staged suite:")
+        changes = [
+            ("Removed", self.removed, self.removed_bytes),
+            ("Added", self.added, self.added_bytes),
+            ("Modified", self.modified, self.modified_bytes),
+        ]
+        for name, files, n_bytes in changes:
+            if files:
+                log.info(f"    - {name} ({len(files)} files, {n_bytes} bytes):")
+                for path in files:
+                    log.info(f"        - {path}")
+        if self.renamed:
+            log.info(f"    - Renamed ({len(self.renamed)} files):")
+            for old_path, new_path in self.renamed:
+                log.info(f"        - {old_path} -> {new_path}")
+
+
+class StagingManifest:
+    def __init__(self, staging_dir, manifest_path):
+        """
+        Persistent manifest of the files of a staging directory.
+        Maps each path to its size, mtime, git mode and git blob hash,
+        so that only files whose stat changed are hashed again.
+
+        Parameters:
+            staging_dir(str): The source suite directory.
+            manifest_path(str): Path of the manifest file.
+        """
+        self.staging_dir = os.path.abspath(staging_dir)
+        self.manifest_path = manifest_path
+        self.scan_time = 0
+        self.files = {}
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, "r") as f:
+                    content = json.load(f)
+                if content["staging_dir"] == self.staging_dir:
+                    self.scan_time = content["time"]
+                    self.files = content["files"]
+            except (ValueError, KeyError):
+                log.info(f"    -> Ignoring invalid manifest {manifest_path}")
+
+    def scan(self, patterns=None):
+        """
+        Scans the staging directory and updates the manifest.
+        Files are only hashed if their size or mtime changed since the last scan.
+
+        Parameters:
+            patterns(list): optional glob patterns, only the matching files are scanned.
+
+        Returns:
+            Dictionary of path -> (git mode, git blob hash, size).
+        """
+        scan_time = time.time_ns()
+        files = {}
+        to_hash = []
+        if patterns is None:
+            listing = scan_files(self.staging_dir)
+        else:
+            listing = select_files(self.staging_dir, patterns)
+        for path, st in listing.items():
+            mode = git_mode(st)
+            entry = self.files.get(path)
+            if (
+                entry is None
+                or entry[:3] != [st.st_size, st.st_mtime_ns, mode]
+                or st.st_mtime_ns >= self.scan_time - RACY_DELAY
+            ):
+                to_hash.append((path, st))
+            else:
+                files[path] = entry
+
+        # hashing is I/O bound, typically on network file systems
+        def hash_file(item):
+            path, st = item
+            fullpath = os.path.join(self.staging_dir, path)
+            return path, [
+                st.st_size,
+                st.st_mtime_ns,
+                git_mode(st),
+                git_blob_hash(fullpath, st),
+            ]
+
+        with ThreadPoolExecutor() as executor:
+            files.update(executor.map(hash_file, to_hash))
+
+        log.info(f"    -> Hashed {len(to_hash)} of {len(files)} staged files")
+        scanned = {
+            path: (entry[2], entry[3], entry[0]) for path, entry in files.items()
+        }
+        if patterns is None:
+            self.files = files
+            self.scan_time = scan_time
+        else:
+            # keep the entries of the files outside of the patterns, and the time of the last
+            # full scan so that entries hashed before it are still checked for racy changes
+            self.files = {
+                path: entry
+                for path, entry in self.files.items()
+                if not any(match_path(path, pattern) for pattern in patterns)
+            }
+            self.files.update(files)
+        return scanned
+
+    def save(self):
+        """
+        Writes the manifest to disk.
+        """
+        content = {
+            "staging_dir": self.staging_dir,
+            "time": self.scan_time,
+            "files": self.files,
+        }
+        # unique temporary file, a manifest can be shared by concurrent runs
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(content, f)
+        os.replace(tmp_path, self.manifest_path)
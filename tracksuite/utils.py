@@ -1,4 +1,19 @@
+import codecs
+import collections
+import os
+import select
+import signal
 import subprocess
+import threading
+import time
+
+from tracksuite import LOGGER as log
+
+# number of output lines kept in the error of a streamed command
+TAIL_LINES = 100
+
+# longest output line read by the asynchronous commands
+LINE_LIMIT = 2**20
 
 
 class CmdError(Exception):
@@ -10,35 +25,220 @@ class CmdError(Exception):
         )
 
 
-def run_cmd(cmd, timeout=300, **kwargs):
+def run_cmd(cmd, timeout=300, tail_lines=TAIL_LINES, **kwargs):
     """
-    Runs a shell command.
+    Runs a shell command, see stream_cmd.
+    The output lines are logged (debug level) as they arrive.
 
     Parameters:
         cmd(str): command to run.
+        timeout(int): seconds after which the command is killed.
+        tail_lines(int): number of output lines kept for the error message.
 
     Returns:
-        Exit code.
+        subprocess.CompletedProcess with the output (stdout and stderr) of the command.
+    """
+    lines = []
+    for line in stream_cmd(cmd, timeout, tail_lines, **kwargs):
+        log.debug(line)
+        lines.append(line)
+    return subprocess.CompletedProcess(cmd, 0, stdout=_join_lines(lines))
+
+
+def _join_lines(lines):
+    return "".join(f"{line}\n" for line in lines)
+
+
+def _kill(process, group=False):
+    # with its own session, kill the shell and its children, only the shell otherwise
+    try:
+        if group:
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+def _feed(stdin, input):
+    try:
+        stdin.write(input.encode())
+        stdin.close()
+    except BrokenPipeError:
+        pass
+
+
+def stream_cmd(
+    cmd, timeout=300, tail_lines=TAIL_LINES, input=None, new_session=False, **kwargs
+):
     """
+    Runs a shell command and yields its output lines (stdout and stderr) as they arrive.
+    Only the last tail_lines lines are kept in memory, for the CmdError raised on failure.
+
+    Parameters:
+        cmd(str): command to run.
+        timeout(int): seconds after which the command is killed.
+        tail_lines(int): number of output lines kept for the error message.
+        input(str): optional data sent to the command stdin.
+        new_session(bool): run the command in its own session, so that its children are
+            killed with it on timeout. The command has no controlling terminal then,
+            and ssh can not prompt for a host key or a passphrase.
+
+    Yields:
+        Output lines, without the trailing newline.
+    """
+    tail = collections.deque(maxlen=tail_lines)
     try:
-        ret = subprocess.run(
+        process = subprocess.Popen(
             cmd,
             shell=True,
-            check=True,
+            stdin=subprocess.PIPE if input is not None else None,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            timeout=timeout,
-            encoding="utf8",
+            start_new_session=new_session,
             **kwargs,
         )
-    except subprocess.TimeoutExpired as exc:
+    except Exception as exc:
+        exc.returncode = 99
+        exc.output = str(exc)
+        raise CmdError("foreign error", exc)
+
+    # the output is read with a deadline rather than until the end of the stream,
+    # children left behind by a killed shell might keep it open
+    deadline = time.monotonic() + timeout
+    decoder = codecs.getincrementaldecoder("utf8")(errors="replace")
+    stdout = process.stdout.fileno()
+    pending = ""
+    timed_out = False
+    try:
+        if input is not None:
+            threading.Thread(
+                target=_feed, args=(process.stdin, input), daemon=True
+            ).start()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            ready, _, _ = select.select([stdout], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(stdout, 65536)
+            if not chunk:
+                break
+            pending += decoder.decode(chunk)
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                tail.append(line)
+                yield line
+        if not timed_out:
+            pending += decoder.decode(b"", final=True)
+            if pending:
+                tail.append(pending)
+                yield pending
+            returncode = process.wait(max(deadline - time.monotonic(), 0.01))
+    except subprocess.TimeoutExpired:
+        timed_out = True
+    finally:
+        if process.poll() is None:
+            # timeout, or the caller stopped reading
+            _kill(process, new_session)
+            process.wait()
+        process.stdout.close()
+
+    output = "\n".join(tail)
+    if timed_out:
+        exc = subprocess.TimeoutExpired(cmd, timeout, output=output)
         exc.returncode = -1
         raise CmdError("timeout", exc)
-    except subprocess.CalledProcessError as exc:
-        exc.output = str(exc)
-        raise CmdError("error", exc)
+    if returncode != 0:
+        raise CmdError(
+            "error", subprocess.CalledProcessError(returncode, cmd, output=output)
+        )
+
+
+async def stream_cmd_async(
+    cmd, timeout=300, tail_lines=TAIL_LINES, input=None, new_session=True, **kwargs
+):
+    """
+    Asynchronous version of stream_cmd, the output lines are yielded
+    without blocking the event loop nor using a thread per command.
+    The commands run in their own session by default, see stream_cmd.
+    """
+    # imported here, asyncio is slow to import and only needed by the asynchronous commands
+    import asyncio
+
+    tail = collections.deque(maxlen=tail_lines)
+    try:
+        process = await asyncio.create_subprocess_shell(
+            cmd,
+            stdin=subprocess.PIPE if input is not None else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=new_session,
+            limit=LINE_LIMIT,
+            **kwargs,
+        )
     except Exception as exc:
         exc.returncode = 99
         exc.output = str(exc)
         raise CmdError("foreign error", exc)
-    return ret
+
+    async def feed():
+        try:
+            process.stdin.write(input.encode())
+            await process.stdin.drain()
+            process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    feeder = asyncio.ensure_future(feed()) if input is not None else None
+    try:
+        while True:
+            line = await asyncio.wait_for(
+                process.stdout.readline(), deadline - loop.time()
+            )
+            if not line:
+                break
+            line = line.decode("utf8", errors="replace").rstrip("\n")
+            tail.append(line)
+            yield line
+        returncode = await asyncio.wait_for(process.wait(), deadline - loop.time())
+    except asyncio.TimeoutError:
+        exc = subprocess.TimeoutExpired(cmd, timeout, output="\n".join(tail))
+        exc.returncode = -1
+        raise CmdError("timeout", exc)
+    finally:
+        if process.returncode is None:
+            _kill(process, new_session)
+            await process.wait()
+        if feeder is not None:
+            feeder.cancel()
+
+    if returncode != 0:
+        raise CmdError(
+            "error",
+            subprocess.CalledProcessError(returncode, cmd, output="\n".join(tail)),
+        )
+
+
+async def run_cmd_async(cmd, timeout=300, tail_lines=TAIL_LINES, **kwargs):
+    """
+    Runs a shell command asynchronously, e.g. to await many remote commands with asyncio.gather.
+    The output lines are logged (debug level) as they arrive.
+
+    Parameters:
+        cmd(str): command to run.
+        timeout(int): seconds after which the command is killed.
+        tail_lines(int): number of output lines kept for the error message.
+
+    Returns:
+        subprocess.CompletedProcess with the output (stdout and stderr) of the command.
+    """
+    lines = []
+    async for line in stream_cmd_async(cmd, timeout, tail_lines, **kwargs):
+        log.debug(line)
+        lines.append(line)
+    return subprocess.CompletedProcess(cmd, 0, stdout=_join_lines(lines))